@@ -0,0 +1,169 @@
+import pandas as pd
+
+CALL_KEYS = ['library', 'source', 'name', 'isOverloaded']
+USAGE_KEYS = CALL_KEYS + ['header', 'install']
+
+
+def header_file(path):
+    # Extracting just the file name from the path
+    return path.split('/')[-1]
+
+
+def install_method(path):
+    return 'APT' if 'usr/include' in path else 'Submod'
+
+
+def filter_overloaded(table, overload_filter):
+    if overload_filter == 'overloaded':
+        return table[table['isOverloaded'].fillna(False)]
+    elif overload_filter == 'not-overloaded':
+        return table[(table['isOverloaded'] == False).fillna(False)]
+    return table
+
+
+def ordered_unique(table, col):
+    # Values in the order they first appear in the loaded usage data
+    firsts = table.groupby(col, observed=True)['first_call'].min().sort_values(kind='stable')
+    return firsts.index.tolist()
+
+
+class UsageIndex:
+    """Small pre-aggregated tables built once from the loaded usage data.
+
+    Dashboard interactions are answered from these tables instead of regrouping every call.
+    """
+
+    def __init__(self, df, args):
+        calls = df[['call', 'num_args', 'count'] + CALL_KEYS].copy()
+        # Mapping a categorical only evaluates the function once per distinct definition file
+        calls['header'] = df['definition.file'].map(header_file)
+        calls['install'] = df['definition.file'].map(install_method)
+        # Collapsed results stand for 'count' identical call sites, every aggregate is weighted by it
+        calls['has_args'] = (calls['num_args'] > 0).astype('int32') * calls['count']
+
+        self.usage = (calls.groupby(USAGE_KEYS, observed=True, dropna=False)
+                      .agg(count=('count', 'sum'), with_args=('has_args', 'sum'), first_call=('call', 'min'))
+                      .reset_index())
+
+        # Argument configuration of every call, e.g. 'const char *, int'
+        signatures = (args['type'].astype(str).groupby(args['call'])
+                      .agg(', '.join)
+                      .reindex(calls['call'], fill_value=''))
+        calls['arg_types'] = pd.Categorical(signatures.to_numpy())
+        self.signatures = (calls.groupby(CALL_KEYS + ['arg_types'], observed=True, dropna=False)['count']
+                           .sum()
+                           .reset_index(name='count'))
+
+        call_keys = calls.set_index('call')[CALL_KEYS + ['count']]
+        arg_calls = args.join(call_keys, on='call')
+        self.arg_types = (arg_calls.groupby(CALL_KEYS + ['position', 'type'], observed=True, dropna=False)['count']
+                          .sum()
+                          .reset_index(name='count'))
+        self.arg_values = (arg_calls[arg_calls['value'].notna()]
+                           .groupby(CALL_KEYS + ['position', 'value'], observed=True, dropna=False)['count']
+                           .sum()
+                           .reset_index(name='count'))
+
+    def select(self, table, selected_libraries, selected_repos, overload_filter='all'):
+        table = table[table['library'].isin(selected_libraries or []) & table['source'].isin(selected_repos or [])]
+        return filter_overloaded(table, overload_filter)
+
+    def repositories(self, selected_libraries):
+        return ordered_unique(self.usage[self.usage['library'].isin(selected_libraries or [])], 'source')
+
+    def has_overloaded(self, selected_libraries, selected_repos):
+        usage = self.select(self.usage, selected_libraries, selected_repos)
+        return bool(usage['isOverloaded'].any())
+
+    def usage_for(self, selected_libraries, selected_repos, overload_filter):
+        return self.select(self.usage, selected_libraries, selected_repos, overload_filter)
+
+    def method_signatures(self, selected_libraries, selected_repos, overload_filter, method):
+        signatures = self.select(self.signatures, selected_libraries, selected_repos, overload_filter)
+        return signatures[signatures['name'] == method]
+
+    def method_arg_types(self, selected_libraries, selected_repos, overload_filter, method):
+        arg_types = self.select(self.arg_types, selected_libraries, selected_repos, overload_filter)
+        return arg_types[arg_types['name'] == method]
+
+    def method_arg_values(self, selected_libraries, selected_repos, overload_filter, method):
+        arg_values = self.select(self.arg_values, selected_libraries, selected_repos, overload_filter)
+        return arg_values[arg_values['name'] == method]
+
+
+def summary_metrics(usage):
+    num_functions_per_repo = usage.groupby('source', observed=True)['count'].sum()
+    num_unique_functions_per_repo = usage.groupby('source', observed=True)['name'].nunique()
+
+    return [
+        {'Metric': 'Number of repositories', 'Value': usage['source'].nunique()},
+        {'Metric': 'Number of functions identified in total', 'Value': usage['count'].sum()},
+        {'Metric': 'Average number of functions identified per repository', 'Value': num_functions_per_repo.mean()},
+        {'Metric': 'Standard deviation of average number of functions per repository',
+         'Value': num_functions_per_repo.std()},
+        {'Metric': 'Median number of functions per repository', 'Value': num_functions_per_repo.median()},
+        {'Metric': 'Number of distinct functions identified', 'Value': usage['name'].nunique()},
+        {'Metric': 'Average number of distinct functions identified per repository',
+         'Value': num_unique_functions_per_repo.mean()},
+        {'Metric': 'Standard deviation of average number of distinct functions per repository',
+         'Value': num_unique_functions_per_repo.std()},
+        {'Metric': 'Median number of unique functions per repository',
+         'Value': num_unique_functions_per_repo.median()},
+    ]
+
+
+def methods_with_args(usage):
+    return ordered_unique(usage[usage['with_args'] > 0], 'name')
+
+
+def api_frequency(usage):
+    return (usage.groupby(['name', 'library'], observed=True)['count']
+            .sum()
+            .reset_index(name='count')
+            .sort_values(by='count', ascending=True))
+
+
+def distinct_calls_per_client(usage):
+    return (usage.groupby(['source', 'library'], observed=True)['name']
+            .nunique()
+            .reset_index(name='count')
+            .sort_values(by='count', ascending=True))
+
+
+def calls_per_client(usage):
+    return (usage.groupby(['source', 'library'], observed=True)['count']
+            .sum()
+            .reset_index(name='count')
+            .sort_values(by='count', ascending=True))
+
+
+def header_usage(usage):
+    return (usage.groupby(['header', 'library'], observed=True)['count']
+            .sum()
+            .reset_index(name='count')
+            .sort_values(by='count', ascending=True)
+            .rename(columns={'header': 'file'}))
+
+
+def install_usage(usage):
+    return (usage.groupby(['install', 'library'], observed=True)['source']
+            .nunique()
+            .reset_index(name='count')
+            .rename(columns={'install': 'Install Method'}))
+
+
+def argument_configurations(signatures):
+    return (signatures.groupby('arg_types', observed=True)['count']
+            .sum()
+            .loc[lambda counts: counts > 0]
+            .sort_values(ascending=False)
+            .reset_index(name='count'))
+
+
+def argument_distribution(table, position, col):
+    return (table[table['position'] == position]
+            .groupby(col, observed=True)['count']
+            .sum()
+            .loc[lambda counts: counts > 0]
+            .sort_values(ascending=False)
+            .reset_index(name='count'))
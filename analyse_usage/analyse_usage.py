@@ -1,49 +1,137 @@
 import os
 import argparse
+from functools import lru_cache, partial
 
 from dash import Dash, html, dash_table, dcc, callback, Output, Input
 import pandas as pd
-import plotly.express as px
 
+from aggregates import UsageIndex, methods_with_args, ordered_unique, summary_metrics
+from figures import FIGURES, method_argument_figures, method_configurations_figure
+from ingest import IngestStats, create_executor, ingest_files, read_records
+from report import write_report
+from schema import compact_usage, concat_categorical, memory_mb
+from usage_cache import load_library_cached
 
-def load_library(dir_path):
-    df = pd.DataFrame()
 
-    for filename in os.listdir(dir_path):
-        if filename.endswith('.json') and "@@" in filename:
-            file_path = os.path.join(dir_path, filename)
+def parse_client_file(file_path):
+    # Expand nested columns
+    data = pd.json_normalize([record['function'] for record in read_records(file_path)])
+    data.dropna(axis=1, inplace=True, how='all')
+
+    # Literal values mix strings and numbers, store them uniformly as strings
+    for col in data.columns:
+        if col.startswith('args.') and col.endswith('.value'):
+            data[col] = data[col].map(lambda x: x if pd.isna(x) else str(x))
 
-            data = pd.read_json(file_path)
+    data['source'] = os.path.splitext(os.path.basename(file_path))[0]
+    return data
 
-            # Expand nested columns
-            data = pd.json_normalize(data['function'])
-            data.dropna(axis=1, inplace=True, how='all')
 
-            data['source'] = os.path.splitext(filename)[0]
+def parse_client_files(file_paths):
+    frames = [parse_client_file(file_path) for file_path in file_paths]
+    return pd.concat(frames, axis=0) if frames else pd.DataFrame()
 
-            df = pd.concat([df, data], axis=0)
 
-    return df
+def list_client_files(dir_path):
+    # A client can be left with both a .json and an .ndjson result after switching --ndjson, only the newer one is read
+    latest = {}
+    for filename in os.listdir(dir_path):
+        if filename.endswith(('.json', '.ndjson')) and "@@" in filename:
+            client = os.path.splitext(filename)[0]
+            mtime = os.path.getmtime(os.path.join(dir_path, filename))
+            if client not in latest or mtime > latest[client][0]:
+                latest[client] = (mtime, filename)
+    return sorted(filename for _, filename in latest.values())
 
 
-def load_libraries(dir_path):
-    df = pd.DataFrame()
-    libraries = []
-    # Iterate through the library directories
-    for library_name in os.listdir(dir_path):
-        library_path = os.path.join(dir_path, library_name)
+def load_library(dir_path, use_cache=True, parse_files=ingest_files):
+    filenames = list_client_files(dir_path)
 
-        # Check if it's a directory
-        if os.path.isdir(library_path):
-            lib_df = load_library(library_path)
-            lib_df['library'] = library_name
-            libraries.append(library_name)
-            df = pd.concat([df, lib_df], axis=0)
-    return df, libraries
+    if use_cache:
+        return load_library_cached(dir_path, filenames, parse_files)
 
+    return parse_files([os.path.join(dir_path, filename) for filename in filenames])
 
-def main(dir_path):
-    df, libraries = load_libraries(dir_path)
+
+def load_libraries(dir_path, use_cache=True, workers=None, legacy=False):
+    call_frames = []
+    arg_frames = []
+    num_calls = 0
+    libraries = []
+    stats = IngestStats()
+    executor = None if legacy else create_executor(workers)
+    if legacy:
+        parse_files = stats.counting(parse_client_files)
+    else:
+        parse_files = stats.counting(partial(ingest_files, executor=executor))
+
+    try:
+        # Iterate through the library directories
+        for library_name in sorted(os.listdir(dir_path)):
+            library_path = os.path.join(dir_path, library_name)
+
+            # Check if it's a directory
+            if os.path.isdir(library_path):
+                lib_df = load_library(library_path, use_cache, parse_files)
+                lib_df['library'] = library_name
+                libraries.append(library_name)
+                stats.add(len(list_client_files(library_path)), lib_df.shape[0])
+
+                # Compact each library as it is loaded so the wide frames never coexist
+                calls, args = compact_usage(lib_df, num_calls)
+                num_calls += len(calls)
+                call_frames.append(calls)
+                arg_frames.append(args)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    # Concatenate once rather than growing the frame per library
+    df = concat_categorical(call_frames)
+    args = concat_categorical(arg_frames)
+    stats.report()
+    print(f"Usage data memory: calls {memory_mb(df):.1f} MB, args {memory_mb(args):.1f} MB")
+    return df, args, libraries
+
+
+def selection_key(selected_libraries, selected_repos):
+    # Order independent, hashable key for the memoized callbacks
+    return tuple(sorted(selected_libraries or [])), tuple(sorted(selected_repos or []))
+
+
+def load_index(dir_path, use_cache=True, workers=None, legacy=False):
+    df, args, libraries = load_libraries(dir_path, use_cache, workers, legacy)
+    # Interactions are answered from pre-aggregated tables, the per-call frames are no longer needed
+    return UsageIndex(df, args), libraries
+
+
+def main(dir_path, use_cache=True, workers=None, legacy=False, cache_size=128):
+    index, libraries = load_index(dir_path, use_cache, workers, legacy)
+
+    @lru_cache(maxsize=cache_size)
+    def cached_usage(libraries_key, repos_key, overload_filter):
+        return index.usage_for(list(libraries_key), list(repos_key), overload_filter)
+
+    @lru_cache(maxsize=cache_size)
+    def cached_figure(figure_id, libraries_key, repos_key, overload_filter):
+        return FIGURES[figure_id](cached_usage(libraries_key, repos_key, overload_filter))
+
+    @lru_cache(maxsize=cache_size)
+    def cached_methods(libraries_key, repos_key, overload_filter):
+        return methods_with_args(cached_usage(libraries_key, repos_key, overload_filter))
+
+    @lru_cache(maxsize=cache_size)
+    def cached_method_charts(libraries_key, repos_key, overload_filter, selected_method):
+        selection = (list(libraries_key), list(repos_key), overload_filter, selected_method)
+        method_fig = method_configurations_figure(index.method_signatures(*selection), selected_method)
+        args_child = []
+        for type_fig, value_fig in method_argument_figures(index.method_arg_types(*selection),
+                                                           index.method_arg_values(*selection), selected_method):
+            div_children = [dcc.Graph(figure=type_fig)]
+            if value_fig is not None:
+                div_children.append(dcc.Graph(figure=value_fig))
+            args_child.append(html.Div(children=div_children, style={'display': 'flex'}))
+        return method_fig, args_child
 
     app = Dash(__name__)
 
@@ -99,7 +187,7 @@ def main(dir_path):
         Input(component_id='library-dropdown', component_property='value'), prevent_initial_call=True
     )
     def reset_overload_option(selected_libraries):
-        repos = df[df['library'].isin(selected_libraries)]['source'].unique().tolist()
+        repos = index.repositories(selected_libraries)
         return "all", None, repos
 
     @callback(
@@ -118,230 +206,76 @@ def main(dir_path):
         return None
 
     @callback(
-        [Output(component_id='api-usage-frequency', component_property='figure'),
-         Output(component_id='client-usage-distinct', component_property='figure'),
-         Output(component_id='client-usage-frequency', component_property='figure'),
-         Output(component_id='header-usage', component_property='figure'),
-         Output(component_id='install-usage', component_property='figure'),
-         Output(component_id='function-filter-radio-item', component_property='options'),
-         Output(component_id='data-summary-table', component_property='data'),
-         Output(component_id='method-dropdown', component_property='options'),
-         Output(component_id='method-freq', component_property='figure'),
-         Output(component_id='method-args', component_property='children'),
-         Output(component_id='repository-dropdown', component_property='options')],
-        [Input(component_id='function-filter-radio-item', component_property='value'),
-         Input(component_id='library-dropdown', component_property='value'),
-         Input(component_id='method-dropdown', component_property='value'),
+        Output(component_id='function-filter-radio-item', component_property='options'),
+        [Input(component_id='library-dropdown', component_property='value'),
          Input(component_id='repository-dropdown', component_property='value')], prevent_initial_call=True
     )
-    def update_bar_chart(overflow_filter, selected_libraries, selected_method, selected_repos):
-        filtered_df = df[df['library'].isin(selected_libraries) & df['source'].isin(selected_repos)]
-
-        has_overloaded = filtered_df['isOverloaded'].any()
-
+    def update_filter_options(selected_libraries, selected_repos):
         # If there are 'Overloaded' values, include the option
-        if has_overloaded:
-            options = [{'label': 'All', 'value': 'all'},
-                       {'label': 'Overloaded', 'value': 'overloaded'},
-                       {'label': 'Not Overloaded', 'value': 'not-overloaded'}]
-        else:
-            options = [{'label': 'All', 'value': 'all'}]
-
-        if overflow_filter == 'overloaded':
-            filtered_df = filtered_df[filtered_df['isOverloaded']]
-        elif overflow_filter == 'not-overloaded':
-            filtered_df = filtered_df[filtered_df['isOverloaded'] == False]
-
-        # Number of unique repositories
-        num_unique_repos = filtered_df['source'].nunique()
-
-        repos = filtered_df['source'].unique().tolist()
-
-        # Number of functions identified in total
-        num_total_functions = filtered_df.shape[0]
-
-        num_functions_per_repo = filtered_df.groupby('source')['name'].count()
-
-        # Average number of functions identified per repository
-        avg_num_functions_per_repo = num_functions_per_repo.mean()
-        std_dev_avg_num_functions_per_repo = num_functions_per_repo.std()
-        median_num_functions_per_repo = num_functions_per_repo.median()
-
-        # Number of unique functions identified
-        num_unique_functions = filtered_df['name'].nunique()
-
-        num_unique_functions_per_repo = filtered_df.groupby('source')['name'].nunique()
-        # Average number of unique functions identified per repository
-        avg_num_unique_functions_per_repo = num_unique_functions_per_repo.mean()
-        # Average number of unique functions identified per repository
-        std_dev_avg_num_unique_functions_per_repo = num_unique_functions_per_repo.std()
-        median_num_unique_functions_per_repo = num_unique_functions_per_repo.median()
-
-        table_data = [
-            {'Metric': 'Number of repositories', 'Value': num_unique_repos},
-            {'Metric': 'Number of functions identified in total', 'Value': num_total_functions},
-            {'Metric': 'Average number of functions identified per repository', 'Value': avg_num_functions_per_repo},
-            {'Metric': 'Standard deviation of average number of functions per repository',
-             'Value': std_dev_avg_num_functions_per_repo},
-            {'Metric': 'Median number of functions per repository', 'Value': median_num_functions_per_repo},
-            {'Metric': 'Number of distinct functions identified', 'Value': num_unique_functions},
-            {'Metric': 'Average number of distinct functions identified per repository',
-             'Value': avg_num_unique_functions_per_repo},
-            {'Metric': 'Standard deviation of average number of distinct functions per repository',
-             'Value': std_dev_avg_num_unique_functions_per_repo},
-            {'Metric': 'Median number of unique functions per repository',
-             'Value': median_num_unique_functions_per_repo},
-        ]
-
-        dff = (filtered_df.groupby(['name', 'library'])
-               .size()
-               .reset_index(name='count')
-               .sort_values(by='count', ascending=True))
-
-        methods = filtered_df[filtered_df['args.0.type'].notna()]['name'].unique().tolist()
-        if selected_method is None:
-            selected_method = methods[0]
-
-        fig1 = px.bar(dff, x='count', y='name', title="API Call Frequency", log_x=True, color='library',
-                      barmode='overlay')
-        height = max(800, len(dff.values) * 20)
-        fig1.update_layout(
-            xaxis_title='Frequency',
-            yaxis_title='API Call',
-            height=height,
-            width=950,
-            showlegend=True
-        )
-
-        method_df = filtered_df[filtered_df['name'] == selected_method]
-        method_df.dropna(axis=1, inplace=True, how='all')
-        # Filter columns based on substring
-        filtered_columns = [col for col in method_df.columns if '.type' in col and 'args.' in col]
-        conf_df = method_df[filtered_columns]
-        # Convert the argument configuration into a string for plotting, excluding 'nan'
-        conf_df['arg_types'] = conf_df[filtered_columns].apply(
-            lambda row: ', '.join([str(x) for x in row if str(x) != 'nan']),
-            axis=1)
-
-        # Count the frequency of each argument configuration
-        dff = conf_df['arg_types'].value_counts().reset_index()
-        dff.columns = ['arg_types', 'count']
-        method_fig = px.bar(dff, x='arg_types', y='count',
-                            title=f"'{selected_method}' Method Argument Type Configurations")
-        method_fig.update_layout(
-            yaxis_title='Frequency',
-            xaxis_title='Argument Configuration',
-            height=800,
-            width=950,
-            showlegend=True
-        )
+        if index.has_overloaded(*selection_key(selected_libraries, selected_repos)):
+            return [{'label': 'All', 'value': 'all'},
+                    {'label': 'Overloaded', 'value': 'overloaded'},
+                    {'label': 'Not Overloaded', 'value': 'not-overloaded'}]
+        return [{'label': 'All', 'value': 'all'}]
 
-        arg_columns = list(range(1, len(filtered_columns) + 1))
-        args_child = []
-
-        for selected_argument in arg_columns:
-            div_children = []
-            # Frequency graph for types
-            dff = method_df[f'args.{selected_argument - 1}.type'].value_counts().reset_index()
-            dff.columns = ['type', 'count']
-
-            type_fig = px.bar(dff, x='type', y='count',
-                              title=f"'{selected_method}' Method Argument '{selected_argument}' Type Distribution")
-            type_fig.update_layout(
-                yaxis_title='Frequency',
-                xaxis_title='Type',
-                height=800,
-                width=950,
-                showlegend=True
-            )
-
-            div_children.append(dcc.Graph(figure=type_fig))
-
-            if f'args.{selected_argument - 1}.value' in method_df.columns:
-                # Frequency graph for values
-                dff = method_df[f'args.{selected_argument - 1}.value'].value_counts().reset_index()
-                dff.columns = ['value', 'count']
-
-                value_fig = px.bar(dff, x='value', y='count',
-                                   title=f"'{selected_method}' Method Argument '{selected_argument}' Value Distribution")
-                value_fig.update_layout(
-                    yaxis_title='Frequency',
-                    xaxis_title='Value',
-                    height=800,
-                    width=950,
-                    showlegend=True
-                )
-                div_children.append(dcc.Graph(figure=value_fig))
-
-            child_div = html.Div(children=div_children, style={'display': 'flex'})
-            args_child.append(child_div)
-
-        dff = (filtered_df.groupby(['source', 'library'])['name']
-               .nunique()
-               .reset_index(name='count')
-               .sort_values(by='count', ascending=True))
-        fig2 = px.bar(dff, x='count', y='source', title="Distinct API Calls per Client", color='library',
-                      barmode='overlay')
-        height = max(800, len(dff.values) * 20)
-        fig2.update_layout(
-            xaxis_title='Distinct Calls',
-            yaxis_title='Client',
-            height=height,
-            width=950,
-            showlegend=True
-        )
+    @callback(
+        Output(component_id='data-summary-table', component_property='data'),
+        [Input(component_id='function-filter-radio-item', component_property='value'),
+         Input(component_id='library-dropdown', component_property='value'),
+         Input(component_id='repository-dropdown', component_property='value')], prevent_initial_call=True
+    )
+    def update_summary_table(overflow_filter, selected_libraries, selected_repos):
+        return summary_metrics(cached_usage(*selection_key(selected_libraries, selected_repos), overflow_filter))
 
-        dff = (filtered_df.groupby(['source', 'library'])['source']
-               .size()
-               .reset_index(name='count')
-               .sort_values(by='count', ascending=True))
-
-        fig3 = px.bar(dff, x='count', y='source', title="Total API Calls per Client", log_x=True, color='library',
-                      barmode='overlay')
-        height = max(800, len(dff.values) * 20)
-        fig3.update_layout(
-            xaxis_title='API Calls',
-            yaxis_title='Client',
-            height=height,
-            width=950,
-            showlegend=True
-        )
+    @callback(
+        Output(component_id='repository-dropdown', component_property='options'),
+        [Input(component_id='function-filter-radio-item', component_property='value'),
+         Input(component_id='library-dropdown', component_property='value'),
+         Input(component_id='repository-dropdown', component_property='value')], prevent_initial_call=True
+    )
+    def update_repository_options(overflow_filter, selected_libraries, selected_repos):
+        return ordered_unique(cached_usage(*selection_key(selected_libraries, selected_repos), overflow_filter),
+                              'source')
 
-        # Extracting just the file name from the path
-        filtered_df['file'] = filtered_df['definition.file'].str.split('/').str[-1]
-        dff = (filtered_df.groupby(['file', 'library'])
-               .size()
-               .reset_index(name='count')
-               .sort_values(by='count', ascending=True))
-
-        fig4 = px.bar(dff, x='count', y='file', title="Header File Usage Frequency", log_x=True, color='library',
-                      barmode='overlay')
-
-        fig4.update_layout(
-            xaxis_title='API Calls',
-            yaxis_title='Header File',
-            height=800,
-            width=950,
-            showlegend=True
+    @callback(
+        Output(component_id='method-dropdown', component_property='options'),
+        [Input(component_id='function-filter-radio-item', component_property='value'),
+         Input(component_id='library-dropdown', component_property='value'),
+         Input(component_id='repository-dropdown', component_property='value')], prevent_initial_call=True
+    )
+    def update_method_options(overflow_filter, selected_libraries, selected_repos):
+        return cached_methods(*selection_key(selected_libraries, selected_repos), overflow_filter)
+
+    # One callback per usage figure so each is only redrawn when its own inputs change
+    def register_figure(figure_id):
+        @callback(
+            Output(component_id=figure_id, component_property='figure'),
+            [Input(component_id='function-filter-radio-item', component_property='value'),
+             Input(component_id='library-dropdown', component_property='value'),
+             Input(component_id='repository-dropdown', component_property='value')], prevent_initial_call=True
         )
+        def update_figure(overflow_filter, selected_libraries, selected_repos):
+            return cached_figure(figure_id, *selection_key(selected_libraries, selected_repos), overflow_filter)
 
-        filtered_df['Install Method'] = filtered_df['definition.file'].apply(
-            lambda x: 'APT' if 'usr/include' in x else 'Submod')
-        dff = (filtered_df.groupby(['Install Method', 'library'])
-               .nunique()['source']
-               .reset_index(name='count'))
-        fig5 = px.bar(dff, x='count', y='Install Method', title="Install Method Popularity", log_x=False,
-                      color='library', barmode='stack')
-
-        fig5.update_layout(
-            xaxis_title='Number of Repositories',
-            yaxis_title='Install Method',
-            height=800,
-            width=950,
-            showlegend=True
-        )
+    for figure_id in FIGURES:
+        register_figure(figure_id)
 
-        return fig1, fig2, fig3, fig4, fig5, options, table_data, methods, method_fig, args_child, repos
+    @callback(
+        [Output(component_id='method-freq', component_property='figure'),
+         Output(component_id='method-args', component_property='children')],
+        [Input(component_id='function-filter-radio-item', component_property='value'),
+         Input(component_id='library-dropdown', component_property='value'),
+         Input(component_id='method-dropdown', component_property='value'),
+         Input(component_id='repository-dropdown', component_property='value')], prevent_initial_call=True
+    )
+    def update_method_charts(overflow_filter, selected_libraries, selected_method, selected_repos):
+        key = selection_key(selected_libraries, selected_repos)
+        if selected_method is None:
+            methods = cached_methods(*key, overflow_filter)
+            if not methods:
+                return {}, []
+            selected_method = methods[0]
+        return cached_method_charts(*key, overflow_filter, selected_method)
 
     app.run(debug=True)
 
@@ -349,5 +283,22 @@ def main(dir_path):
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Process usage data')
     parser.add_argument('dir_path', type=str, help='The directory to be parsed', default='../example_results')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='Re-parse every client file instead of using the per-library parquet cache')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='Number of processes used to parse client files (default: cpu count, 1 disables the pool)')
+    parser.add_argument('--legacy-ingest', action='store_true',
+                        help='Parse client files with pd.read_json/pd.json_normalize, for comparison')
+    parser.add_argument('--cache-size', type=int, default=128,
+                        help='Number of selections memoized per dashboard callback')
+    parser.add_argument('--report', type=str, metavar='OUT_DIR',
+                        help='Write metrics, aggregate tables and figures of every library to OUT_DIR '
+                             'instead of starting the dashboard')
+    parser.add_argument('--figure-format', type=str, default='html', choices=['html', 'png', 'svg', 'pdf', 'none'],
+                        help='Format of report figures, image formats require kaleido')
     args = parser.parse_args()
-    main(args.dir_path)
+    if args.report:
+        write_report(*load_index(args.dir_path, not args.no_cache, args.workers, args.legacy_ingest), args.report,
+                     args.figure_format)
+    else:
+        main(args.dir_path, not args.no_cache, args.workers, args.legacy_ingest, args.cache_size)
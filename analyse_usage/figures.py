@@ -0,0 +1,135 @@
+import plotly.express as px
+
+from aggregates import (api_frequency, argument_configurations, argument_distribution, calls_per_client,
+                        distinct_calls_per_client, header_usage, install_usage)
+
+
+def api_frequency_figure(usage):
+    dff = api_frequency(usage)
+    fig = px.bar(dff, x='count', y='name', title="API Call Frequency", log_x=True, color='library',
+                 barmode='overlay')
+    height = max(800, len(dff.values) * 20)
+    fig.update_layout(
+        xaxis_title='Frequency',
+        yaxis_title='API Call',
+        height=height,
+        width=950,
+        showlegend=True
+    )
+    return fig
+
+
+def distinct_calls_figure(usage):
+    dff = distinct_calls_per_client(usage)
+    fig = px.bar(dff, x='count', y='source', title="Distinct API Calls per Client", color='library',
+                 barmode='overlay')
+    height = max(800, len(dff.values) * 20)
+    fig.update_layout(
+        xaxis_title='Distinct Calls',
+        yaxis_title='Client',
+        height=height,
+        width=950,
+        showlegend=True
+    )
+    return fig
+
+
+def calls_per_client_figure(usage):
+    dff = calls_per_client(usage)
+    fig = px.bar(dff, x='count', y='source', title="Total API Calls per Client", log_x=True, color='library',
+                 barmode='overlay')
+    height = max(800, len(dff.values) * 20)
+    fig.update_layout(
+        xaxis_title='API Calls',
+        yaxis_title='Client',
+        height=height,
+        width=950,
+        showlegend=True
+    )
+    return fig
+
+
+def header_usage_figure(usage):
+    dff = header_usage(usage)
+    fig = px.bar(dff, x='count', y='file', title="Header File Usage Frequency", log_x=True, color='library',
+                 barmode='overlay')
+    fig.update_layout(
+        xaxis_title='API Calls',
+        yaxis_title='Header File',
+        height=800,
+        width=950,
+        showlegend=True
+    )
+    return fig
+
+
+def install_usage_figure(usage):
+    dff = install_usage(usage)
+    fig = px.bar(dff, x='count', y='Install Method', title="Install Method Popularity", log_x=False,
+                 color='library', barmode='stack')
+    fig.update_layout(
+        xaxis_title='Number of Repositories',
+        yaxis_title='Install Method',
+        height=800,
+        width=950,
+        showlegend=True
+    )
+    return fig
+
+
+def method_configurations_figure(signatures, selected_method):
+    # Count the frequency of each argument configuration
+    dff = argument_configurations(signatures)
+    fig = px.bar(dff, x='arg_types', y='count',
+                 title=f"'{selected_method}' Method Argument Type Configurations")
+    fig.update_layout(
+        yaxis_title='Frequency',
+        xaxis_title='Argument Configuration',
+        height=800,
+        width=950,
+        showlegend=True
+    )
+    return fig
+
+
+def method_argument_figures(method_types, method_values, selected_method):
+    """Type (and literal value, when any were recorded) distribution figures for each argument position."""
+    figures = []
+    for position in sorted(method_types['position'].unique()):
+        selected_argument = position + 1
+        # Frequency graph for types
+        dff = argument_distribution(method_types, position, 'type')
+        type_fig = px.bar(dff, x='type', y='count',
+                          title=f"'{selected_method}' Method Argument '{selected_argument}' Type Distribution")
+        type_fig.update_layout(
+            yaxis_title='Frequency',
+            xaxis_title='Type',
+            height=800,
+            width=950,
+            showlegend=True
+        )
+
+        value_fig = None
+        if (method_values['position'] == position).any():
+            # Frequency graph for values
+            dff = argument_distribution(method_values, position, 'value')
+            value_fig = px.bar(dff, x='value', y='count',
+                               title=f"'{selected_method}' Method Argument '{selected_argument}' Value Distribution")
+            value_fig.update_layout(
+                yaxis_title='Frequency',
+                xaxis_title='Value',
+                height=800,
+                width=950,
+                showlegend=True
+            )
+        figures.append((type_fig, value_fig))
+    return figures
+
+
+FIGURES = {
+    'api-usage-frequency': api_frequency_figure,
+    'client-usage-distinct': distinct_calls_figure,
+    'client-usage-frequency': calls_per_client_figure,
+    'header-usage': header_usage_figure,
+    'install-usage': install_usage_figure,
+}
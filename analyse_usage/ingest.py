@@ -0,0 +1,163 @@
+import os
+import json
+import time
+import resource
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+
+def flatten_record(obj, prefix, row):
+    # Mirror pd.json_normalize naming: nested keys are joined with '.'
+    for key, value in obj.items():
+        name = prefix + key
+        if isinstance(value, dict):
+            flatten_record(value, name + '.', row)
+        else:
+            row[name] = value
+
+
+def expand_call(call, declarations):
+    # Rebuild the full record of a call written with --layout=declarations/collapsed
+    function = {}
+    if 'location' in call:
+        function['location'] = call['location']
+    function.update((key, value) for key, value in declarations[call['decl']].items() if key != 'id')
+    function['args'] = call.get('args')
+    if 'count' in call:
+        function['count'] = call['count']
+    return {'function': function}
+
+
+def read_records(file_path):
+    """Yield the {'function': {...}} record of every call in a find-call result file.
+
+    Handles a json array or NDJSON (--ndjson) of full records, and the declaration table layouts, whose
+    collapsed calls carry a 'count' of the identical call sites they stand for.
+    """
+    declarations = {}
+    with open(file_path, 'r') as f:
+        if file_path.endswith('.ndjson'):
+            for line in f:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                if 'declaration' in record:
+                    declarations[record['declaration']['id']] = record['declaration']
+                elif 'call' in record:
+                    yield expand_call(record['call'], declarations)
+                else:
+                    yield record
+        else:
+            data = json.load(f) or []
+            if isinstance(data, dict):
+                declarations = {declaration['id']: declaration for declaration in data.get('declarations') or []}
+                for call in data.get('calls') or []:
+                    yield expand_call(call, declarations)
+            else:
+                yield from data
+
+
+def parse_client_columns(file_path):
+    """Parse one find-call result file straight into column buffers.
+
+    Returns the client name, a dict of column name -> list of values and the number of rows.
+    """
+    columns = {}
+    num_rows = 0
+    for record in read_records(file_path):
+        row = {}
+        flatten_record(record.get('function') or {}, '', row)
+        for key, value in row.items():
+            column = columns.get(key)
+            if column is None:
+                column = columns[key] = [None] * num_rows
+            # Literal values mix strings and numbers, store them uniformly as strings
+            if value is not None and key.startswith('args.') and key.endswith('.value'):
+                value = str(value)
+            column.append(value)
+        num_rows += 1
+        for column in columns.values():
+            if len(column) < num_rows:
+                column.append(None)
+
+    # Drop columns that never held a value, as the pandas path does with dropna(how='all')
+    columns = {key: column for key, column in columns.items() if any(x is not None for x in column)}
+    source = os.path.splitext(os.path.basename(file_path))[0]
+    return source, columns, num_rows
+
+
+def merge_columns(parsed):
+    names = []
+    seen = set()
+    for _, columns, _ in parsed:
+        for name in columns:
+            if name not in seen:
+                seen.add(name)
+                names.append(name)
+
+    merged = {name: [] for name in names}
+    sources = []
+    for source, columns, num_rows in parsed:
+        for name in names:
+            column = columns.get(name)
+            merged[name].extend(column if column is not None else [None] * num_rows)
+        sources.extend([source] * num_rows)
+    merged['source'] = sources
+    return pd.DataFrame(merged)
+
+
+def ingest_files(file_paths, executor=None):
+    """Parse client files, in parallel when given a process pool, and build a single frame."""
+    if executor is None:
+        parsed = [parse_client_columns(file_path) for file_path in file_paths]
+    else:
+        chunksize = max(1, len(file_paths) // (4 * (os.cpu_count() or 1)))
+        parsed = list(executor.map(parse_client_columns, file_paths, chunksize=chunksize))
+    return merge_columns(parsed)
+
+
+def create_executor(workers):
+    if workers is not None and workers <= 1:
+        return None
+    return ProcessPoolExecutor(max_workers=workers)
+
+
+def peak_rss_mb():
+    # ru_maxrss is reported in kilobytes on Linux
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+    return own, children
+
+
+class IngestStats:
+    # The files/s rate is over the files actually parsed and the time spent parsing them, files read back from the
+    # parquet cache are reported separately
+    def __init__(self):
+        self.files = 0
+        self.parsed = 0
+        self.parse_seconds = 0.0
+        self.rows = 0
+        self.start = time.perf_counter()
+
+    def add(self, num_files, num_rows):
+        self.files += num_files
+        self.rows += num_rows
+
+    def counting(self, parse_files):
+        def parse_counted(file_paths):
+            start = time.perf_counter()
+            try:
+                return parse_files(file_paths)
+            finally:
+                self.parsed += len(file_paths)
+                self.parse_seconds += time.perf_counter() - start
+        return parse_counted
+
+    def report(self):
+        elapsed = time.perf_counter() - self.start
+        rate = self.parsed / self.parse_seconds if self.parse_seconds > 0 else 0.0
+        own, children = peak_rss_mb()
+        print(f"Loaded {self.rows} calls from {self.files} client files in {elapsed:.2f}s: {self.parsed} parsed in "
+              f"{self.parse_seconds:.2f}s ({rate:.1f} files/s), {self.files - self.parsed} from the usage cache, "
+              f"peak RSS: {own:.1f} MB (workers: {children:.1f} MB)")
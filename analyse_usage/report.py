@@ -0,0 +1,60 @@
+import os
+import time
+
+import pandas as pd
+
+from aggregates import (api_frequency, calls_per_client, distinct_calls_per_client, header_usage, install_usage,
+                        summary_metrics)
+from figures import FIGURES
+
+# Aggregate tables written for every library, keyed by output file name
+TABLES = {
+    'api_frequency': api_frequency,
+    'distinct_calls_per_client': distinct_calls_per_client,
+    'calls_per_client': calls_per_client,
+    'header_usage': header_usage,
+    'install_usage': install_usage,
+}
+
+
+def write_figure(fig, path, figure_format):
+    if figure_format == 'html':
+        fig.write_html(path + '.html', include_plotlyjs='cdn')
+    else:
+        # Static image export requires the kaleido package
+        fig.write_image(path + '.' + figure_format)
+
+
+def write_library_report(index, library, out_dir, figure_format):
+    library_dir = os.path.join(out_dir, library)
+    os.makedirs(library_dir, exist_ok=True)
+
+    repos = index.repositories([library])
+    usage = index.usage_for([library], repos, 'all')
+
+    metrics = summary_metrics(usage)
+    pd.DataFrame(metrics).to_csv(os.path.join(library_dir, 'metrics.csv'), index=False)
+
+    for name, aggregate in TABLES.items():
+        aggregate(usage).to_csv(os.path.join(library_dir, name + '.csv'), index=False)
+
+    if figure_format != 'none':
+        for figure_id, make_figure in FIGURES.items():
+            write_figure(make_figure(usage), os.path.join(library_dir, figure_id), figure_format)
+
+    return {row['Metric']: row['Value'] for row in metrics}
+
+
+def write_report(index, libraries, out_dir, figure_format='html'):
+    """Write the dashboard metrics, aggregate tables and figures of every library to out_dir."""
+    start = time.perf_counter()
+    os.makedirs(out_dir, exist_ok=True)
+
+    summary = {}
+    for library in libraries:
+        summary[library] = write_library_report(index, library, out_dir, figure_format)
+        print(f"Wrote report for {library}")
+
+    summary_path = os.path.join(out_dir, 'summary.csv')
+    pd.DataFrame.from_dict(summary, orient='index').rename_axis('library').to_csv(summary_path)
+    print(f"Wrote reports for {len(libraries)} libraries to {out_dir} in {time.perf_counter() - start:.2f}s")
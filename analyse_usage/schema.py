@@ -0,0 +1,107 @@
+import re
+
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+# Strings repeated across many calls, stored as categoricals
+CATEGORY_COLUMNS = ['name', 'source', 'library', 'definition.file', 'location.file', 'functionDeclReturn',
+                    'callExprReturn', 'return']
+INT_COLUMNS = ['definition.line', 'definition.offset', 'location.line', 'location.offset']
+ARG_COLUMN = re.compile(r'^args\.(\d+)\.(type|value)$')
+
+
+def is_flag_column(col):
+    return col.startswith('is') or col == 'hasBody'
+
+
+def to_category(values):
+    # Keep categories as plain object dtype so frames of different libraries can be unioned
+    values = pd.Series(values, dtype=object)
+    categories = pd.Index(values.dropna().unique(), dtype=object)
+    return pd.Categorical(values, categories=categories)
+
+
+def split_args(df):
+    """Move the wide 'args.N.type'/'args.N.value' columns into a long (call, position, type, value) frame."""
+    positions = {}
+    for col in df.columns:
+        match = ARG_COLUMN.match(col)
+        if match:
+            positions.setdefault(int(match.group(1)), {})[match.group(2)] = col
+
+    frames = []
+    for position in sorted(positions):
+        cols = positions[position]
+        if 'type' not in cols:
+            continue
+        present = df[cols['type']].notna()
+        frame = pd.DataFrame({
+            'call': df.loc[present, 'call'].to_numpy(),
+            'position': position,
+            'type': df.loc[present, cols['type']].to_numpy(),
+            'value': (df.loc[present, cols['value']].to_numpy() if 'value' in cols else None),
+        })
+        frames.append(frame)
+
+    if frames:
+        args = pd.concat(frames, axis=0, ignore_index=True)
+    else:
+        args = pd.DataFrame({'call': [], 'position': [], 'type': [], 'value': []})
+
+    args = args.astype({'call': 'int32', 'position': 'int16'})
+    args['type'] = to_category(args['type'])
+    args['value'] = to_category(args['value'])
+    args = args.sort_values(['call', 'position'], kind='stable').reset_index(drop=True)
+    return args
+
+
+def compact_usage(df, first_call=0):
+    """Convert a wide usage frame into compactly typed (calls, args) frames.
+
+    Each call gets an integer 'call' id starting at first_call that links it to its rows in args and a 'count'
+    of the call sites it represents.
+    """
+    df = df.reset_index(drop=True)
+    df['call'] = pd.RangeIndex(first_call, first_call + len(df)).astype('int32')
+
+    args = split_args(df)
+    num_args = args.groupby('call').size()
+
+    arg_columns = [col for col in df.columns if col == 'args' or col.startswith('args.')]
+    calls = df.drop(columns=arg_columns)
+    calls['num_args'] = calls['call'].map(num_args).fillna(0).astype('int16')
+    # Number of call sites each row stands for, above 1 only for collapsed find-call results
+    if 'count' in calls.columns:
+        calls['count'] = calls['count'].fillna(1).astype('int32')
+    else:
+        calls['count'] = pd.Series(1, index=calls.index, dtype='int32')
+
+    for col in calls.columns:
+        if col in CATEGORY_COLUMNS:
+            calls[col] = to_category(calls[col])
+        elif col in INT_COLUMNS:
+            calls[col] = calls[col].astype('Int32')
+        elif is_flag_column(col):
+            calls[col] = calls[col].astype('boolean')
+    return calls, args
+
+
+def concat_categorical(frames):
+    """Concatenate frames keeping categorical columns categorical by unioning their categories."""
+    frames = [frame for frame in frames if not frame.empty]
+    if not frames:
+        return pd.DataFrame()
+
+    merged = pd.concat(frames, axis=0, ignore_index=True)
+    for col in merged.columns:
+        present = [frame[col] for frame in frames if col in frame.columns]
+        if not all(isinstance(part.dtype, pd.CategoricalDtype) for part in present):
+            continue
+        parts = [frame[col] if col in frame.columns else pd.Series(to_category([None] * len(frame)))
+                 for frame in frames]
+        merged[col] = union_categoricals(parts, ignore_order=True)
+    return merged
+
+
+def memory_mb(df):
+    return df.memory_usage(deep=True).sum() / 1024 ** 2
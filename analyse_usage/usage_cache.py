@@ -0,0 +1,78 @@
+import os
+import json
+
+import pandas as pd
+
+CACHE_DIR_NAME = '.usage_cache'
+# Bump whenever the cached frame's layout changes (columns, dtypes, what is parsed into it)
+CACHE_VERSION = 2
+
+
+def file_signature(file_path):
+    stat = os.stat(file_path)
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+def read_manifest(cache_path):
+    manifest_path = os.path.join(cache_path, 'manifest.json')
+    try:
+        with open(manifest_path, 'r') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    # Discard caches written by an older layout
+    if manifest.get('version') != CACHE_VERSION:
+        return {}
+    return manifest.get('files', {})
+
+
+def write_cache(cache_path, df, signatures):
+    os.makedirs(cache_path, exist_ok=True)
+    frame_path = os.path.join(cache_path, 'usage.parquet')
+    manifest_path = os.path.join(cache_path, 'manifest.json')
+
+    # Write to temporary files first so an interrupted run never leaves a torn cache behind
+    df.reset_index(drop=True).to_parquet(frame_path + '.tmp', index=False)
+    with open(manifest_path + '.tmp', 'w') as f:
+        json.dump({'version': CACHE_VERSION, 'files': signatures}, f)
+    os.replace(frame_path + '.tmp', frame_path)
+    os.replace(manifest_path + '.tmp', manifest_path)
+
+
+def load_library_cached(dir_path, filenames, parse_files):
+    """Load the usage data of a library directory through its on-disk parquet cache.
+
+    Only client files whose mtime or size differ from the cached manifest are re-parsed with
+    parse_files, the remaining rows are read back from the cache.
+    """
+    cache_path = os.path.join(dir_path, CACHE_DIR_NAME)
+    signatures = {filename: file_signature(os.path.join(dir_path, filename)) for filename in filenames}
+
+    manifest = read_manifest(cache_path)
+    cached = None
+    if manifest:
+        try:
+            cached = pd.read_parquet(os.path.join(cache_path, 'usage.parquet'))
+        except (ImportError, OSError, ValueError):
+            manifest = {}
+
+    stale = [filename for filename in filenames if manifest.get(filename) != signatures[filename]]
+    removed = [filename for filename in manifest if filename not in signatures]
+
+    if cached is not None and not stale and not removed:
+        return cached
+
+    frames = []
+    if cached is not None:
+        # Drop rows belonging to client files that changed or disappeared since the cache was written
+        outdated = {os.path.splitext(filename)[0] for filename in stale + removed}
+        frames.append(cached[~cached['source'].isin(outdated)])
+    if stale:
+        frames.append(parse_files([os.path.join(dir_path, filename) for filename in stale]))
+
+    df = pd.concat(frames, axis=0) if frames else pd.DataFrame()
+    try:
+        write_cache(cache_path, df, signatures)
+    except (ImportError, OSError) as e:
+        print(f"Unable to write usage cache for {dir_path}: {e}")
+    return df
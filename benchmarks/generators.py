@@ -0,0 +1,137 @@
+import os
+import json
+import random
+
+FLAGS = ['hasBody', 'isDefaulted', 'isFunctionTemplateSpecialization', 'isImplicitlyInstantiable ', 'isInlineSpecified',
+         'isInlined', 'isOverloaded', 'isPure', 'isStatic', 'isTemplateInstantiation', 'isUserProvided', 'isVariadic',
+         'isVirtualAsWritten', 'isCXXMethodDecl']
+ARG_TYPES = ['int', 'long', 'size_t', 'const char *', 'void *', 'double', 'bool', 'const std::string &',
+             'unsigned int', 'CURLcode']
+RETURN_TYPES = ['void', 'int', 'bool', 'const char *', 'size_t', 'CURLcode']
+EXTRACTORS = ['cmake', 'submod', 'make', 'conan', 'vcpkg', 'pkgconfig']
+
+
+def make_api(library, num_functions, rng):
+    """Declarations of a synthetic library, each call site of a function repeats its declaration."""
+    api = []
+    for i in range(num_functions):
+        flags = {flag: rng.random() < 0.1 for flag in FLAGS}
+        api.append({
+            'name': f"{library}_fn{i}",
+            'args': [rng.choice(ARG_TYPES) for _ in range(rng.choice((0, 1, 1, 2, 2, 3, 4)))],
+            'return': rng.choice(RETURN_TYPES),
+            'definition': {'file': f"/usr/include/{library}/{library}{i % 8}.h" if rng.random() < 0.5
+                           else f"/src/third_party/{library}/include/{library}{i % 8}.h",
+                           'line': rng.randint(1, 4000), 'offset': rng.randint(1, 40)},
+            'flags': flags,
+        })
+    return api
+
+
+def usage_record(function, client, rng):
+    """One call in the find-call result schema."""
+    args = {}
+    for position, arg_type in enumerate(function['args']):
+        arg = {'type': arg_type}
+        # A few arguments are literals, find-call records their value
+        if rng.random() < 0.05:
+            arg['value'] = rng.choice(['foo', 'bar', 0, 1, 42, 'application/json'])
+        args[str(position)] = arg
+    record = {
+        'args': args,
+        'callExprReturn': function['return'],
+        'definition': function['definition'],
+        'functionDeclReturn': function['return'],
+        'location': {'file': f"/src/{client}/src/file{rng.randint(0, 200)}.cpp", 'line': rng.randint(1, 5000),
+                     'offset': rng.randint(1, 80)},
+        'name': function['name'],
+    }
+    record.update(function['flags'])
+    return {'function': record}
+
+
+def write_usage(out_dir, num_calls, num_libraries=4, num_clients=None, num_functions=300, ndjson=False, seed=0):
+    """Write results/<library>/<client>.json files holding num_calls calls in total, as analyse_usage reads them."""
+    rng = random.Random(seed)
+    num_clients = num_clients or max(1, num_calls // 500)
+    written = 0
+    for library_index in range(num_libraries):
+        library = f"lib{library_index}"
+        api = make_api(library, num_functions, rng)
+        library_dir = os.path.join(out_dir, library)
+        os.makedirs(library_dir, exist_ok=True)
+        library_calls = num_calls // num_libraries + (1 if library_index < num_calls % num_libraries else 0)
+        clients = num_clients // num_libraries or 1
+        for client_index in range(clients):
+            client = f"owner{client_index}@@client{library_index}_{client_index}"
+            calls = library_calls // clients + (1 if client_index < library_calls % clients else 0)
+            # Skewed towards a few popular functions, like real API usage
+            records = [usage_record(api[min(int(rng.paretovariate(1.2)) - 1, num_functions - 1)], client, rng)
+                       for _ in range(calls)]
+            path = os.path.join(library_dir, client + ('.ndjson' if ndjson else '.json'))
+            with open(path, 'w') as f:
+                if ndjson:
+                    f.writelines(json.dumps(record) + '\n' for record in records)
+                else:
+                    json.dump(records, f)
+            written += calls
+    return written
+
+
+def write_repo2dep(path, num_repos=25000, num_libraries=5000, mean_dependencies=8, seed=0):
+    """Write a repo2dep.json shaped like the CCScanner dataset: repo -> library -> [dependency evidence]."""
+    rng = random.Random(seed)
+    libraries = [f"library{i}" for i in range(num_libraries)]
+    data = {}
+    for repo_index in range(num_repos):
+        dependencies = {}
+        for _ in range(int(rng.expovariate(1 / mean_dependencies))):
+            # Popular libraries are depended on far more often
+            library = libraries[min(int(rng.paretovariate(0.8)) - 1, num_libraries - 1)]
+            dependencies[library] = [{'extractor_type': rng.choice(EXTRACTORS), 'version': f"{rng.randint(0, 9)}.0",
+                                      'version_op': '>=', 'confidence': 'High'}
+                                     for _ in range(rng.randint(1, 3))]
+        data[f"owner{repo_index}@@repo{repo_index}"] = dependencies
+    with open(path, 'w') as f:
+        json.dump(data, f)
+    return libraries
+
+
+def write_compile_commands(repo_dir, num_entries=5000, library='zlib', reach=0.2, seed=0):
+    """Write a source tree of num_entries TUs and its compile_commands.json, about reach of them include the library.
+
+    Every TU includes a chain of project headers, the library header is included from a header or directly.
+    """
+    rng = random.Random(seed)
+    include_dir = os.path.join(repo_dir, 'include')
+    library_dir = os.path.join(repo_dir, 'third_party', library, 'include')
+    os.makedirs(include_dir, exist_ok=True)
+    os.makedirs(library_dir, exist_ok=True)
+    with open(os.path.join(library_dir, f"{library}.h"), 'w') as f:
+        f.write(f"int {library}_version(void);\n")
+    num_headers = 200
+    for i in range(num_headers):
+        with open(os.path.join(include_dir, f"header{i}.h"), 'w') as f:
+            f.write("#pragma once\n#include <string>\n")
+            if i + 1 < num_headers and rng.random() < 0.7:
+                f.write(f'#include "header{i + 1}.h"\n')
+            if i % 50 == 49:
+                f.write(f"#include <{library}.h>\n")
+
+    entries = []
+    for i in range(num_entries):
+        directory = os.path.join(repo_dir, 'src', f"module{i % 40}")
+        os.makedirs(directory, exist_ok=True)
+        source = os.path.join(directory, f"file{i}.cpp")
+        with open(source, 'w') as f:
+            f.write("#include <vector>\n")
+            if rng.random() < reach / 2:
+                f.write(f"#include <{library}.h>\n")
+            else:
+                f.write(f'#include "header{rng.randrange(num_headers)}.h"\n')
+            f.write(f"int f{i}() {{ return {i}; }}\n")
+        entries.append({'directory': directory, 'file': source,
+                        'command': f"/usr/bin/c++ -I{include_dir} -isystem {library_dir} -O2 -o file{i}.o -c {source}"})
+    with open(os.path.join(repo_dir, 'compile_commands.json'), 'w') as f:
+        json.dump(entries, f)
+    return entries
@@ -0,0 +1,250 @@
+import os
+import io
+import sys
+import json
+import time
+import shutil
+import argparse
+import statistics
+import subprocess
+import contextlib
+from pathlib import Path
+
+from generators import write_compile_commands, write_repo2dep, write_usage
+
+# The benchmarked scripts import their helper modules as top level modules
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.append(str(ROOT))
+sys.path.append(str(ROOT / 'analyse_usage'))
+sys.path.append(str(ROOT / 'find_usage'))
+
+# Calls in the synthetic usage data of each scale
+SCALES = {'small': 10_000, 'medium': 100_000, 'large': 1_000_000}
+SUITES = ('ingest', 'interactions', 'clients', 'files')
+# Changes smaller than this are reported as noise, wider when the timings themselves vary more
+THRESHOLD = 0.10
+# Earlier results a benchmark is compared against, by their median
+HISTORY = 5
+# Runs a benchmark needs before it is called slower or faster
+MIN_REPEAT = 3
+
+
+def commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, cwd=ROOT,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def relative_spread(record):
+    # How far the median of a result's runs is above its fastest run, 0 for a single run
+    return (record['median'] - record['min']) / record['median'] if record['median'] > 0 else 0.0
+
+
+class Recorder:
+    """Times benchmarks and appends each result to a JSONL file.
+
+    A result is compared against the median of the last HISTORY results of the same benchmark, preferring results
+    of at least MIN_REPEAT runs. It is only called slower or faster with at least MIN_REPEAT runs, two earlier
+    results, and when the change exceeds THRESHOLD, twice the spread of its own runs and twice the usual deviation
+    of the earlier results, so noisy benchmarks need a larger change.
+    """
+
+    def __init__(self, path, repeat, scale):
+        self.path = path
+        self.repeat = repeat
+        self.scale = scale
+        self.commit = commit()
+        self.history = {}
+        if os.path.exists(path):
+            with open(path, 'r') as f:
+                for line in f:
+                    if line.strip():
+                        record = json.loads(line)
+                        self.history.setdefault((record['name'], record['dataset']), []).append(record)
+
+    def time(self, name, dataset, fn, repeat=None):
+        times = []
+        result = None
+        for _ in range(repeat or self.repeat):
+            start = time.perf_counter()
+            # Silence the progress the timed functions print
+            with contextlib.redirect_stdout(io.StringIO()):
+                result = fn()
+            times.append(time.perf_counter() - start)
+        record = {'name': name, 'dataset': dataset, 'scale': self.scale, 'median': statistics.median(times),
+                  'min': min(times), 'repeat': len(times), 'commit': self.commit, 'timestamp': time.time()}
+        self.report(record)
+        with open(self.path, 'a') as f:
+            f.write(json.dumps(record) + '\n')
+        return result
+
+    def compare(self, record):
+        previous = self.history.get((record['name'], record['dataset']), [])
+        # Single run results are too noisy to compare against when there are better ones
+        previous = [result for result in previous if result['repeat'] >= MIN_REPEAT] or previous
+        previous = previous[-HISTORY:]
+        baseline = statistics.median(result['median'] for result in previous) if previous else 0
+        if baseline <= 0:
+            return ''
+        ratio = record['median'] / baseline - 1
+        if len(previous) > 1:
+            against = f"median of {len(previous)} earlier results"
+        else:
+            against = previous[0].get('commit') or 'previous run'
+        if record['repeat'] < MIN_REPEAT:
+            return f"{ratio:+.0%} vs {against}, too few runs for a verdict"
+        if len(previous) < 2:
+            # How much one benchmark varies between runs is only known from several earlier results
+            return f"{ratio:+.0%} vs {against}, too few earlier results for a verdict"
+        deviation = statistics.median(abs(result['median'] / baseline - 1) for result in previous)
+        threshold = max(THRESHOLD, 2 * relative_spread(record), 2 * deviation)
+        verdict = 'slower' if ratio > threshold else 'faster' if ratio < -threshold else 'unchanged'
+        return f"{ratio:+.0%} {verdict} vs {against} (noise {threshold:.0%})"
+
+    def report(self, record):
+        change = self.compare(record)
+        print(f"{record['name']:<32} {record['dataset']:<40} {record['median'] * 1000:>10.1f}ms "
+              f"(min {record['min'] * 1000:.1f}ms)  {change}")
+
+
+def usage_datasets(data_dir, scale, example_results):
+    num_calls = SCALES[scale]
+    path = data_dir / f"usage-{num_calls}"
+    if not (path / 'done').exists():
+        print(f"Generating {num_calls} calls in {path}")
+        write_usage(str(path), num_calls)
+        (path / 'done').touch()
+    datasets = {f"synthetic-{num_calls}": path}
+    if example_results:
+        # Benchmarked on a copy, the parquet cache would otherwise be written into the tracked example data
+        copy = data_dir / 'example_results'
+        if not (copy / 'done').exists():
+            shutil.rmtree(copy, ignore_errors=True)
+            shutil.copytree(ROOT / 'example_results', copy, ignore=shutil.ignore_patterns('.usage_cache'))
+            (copy / 'done').touch()
+        datasets['example_results'] = copy
+    return datasets
+
+
+def bench_ingest(recorder, datasets):
+    from analyse_usage import load_libraries
+
+    for dataset, path in datasets.items():
+        recorder.time('load_libraries', dataset, lambda: load_libraries(str(path), use_cache=False))
+        # Warm the parquet cache, then time loading from it
+        with contextlib.redirect_stdout(io.StringIO()):
+            load_libraries(str(path), use_cache=True)
+        recorder.time('load_libraries_cached', dataset, lambda: load_libraries(str(path), use_cache=True))
+
+
+def bench_interactions(recorder, datasets):
+    from aggregates import UsageIndex, methods_with_args, ordered_unique, summary_metrics
+    from analyse_usage import load_libraries
+    from figures import FIGURES, method_argument_figures, method_configurations_figure
+
+    for dataset, path in datasets.items():
+        with contextlib.redirect_stdout(io.StringIO()):
+            df, args, libraries = load_libraries(str(path), use_cache=True)
+        index = recorder.time('usage_index', dataset, lambda: UsageIndex(df, args))
+
+        # The dashboard's interactions, for one library and for every library selected
+        for selection_name, selected in (('one library', libraries[:1]), ('all libraries', libraries)):
+            label = f"{dataset} ({selection_name})"
+            repos = recorder.time('select_libraries', label, lambda: index.repositories(selected))
+            usage = recorder.time('usage_for', label, lambda: index.usage_for(selected, repos, 'all'))
+            recorder.time('overload_filter', label, lambda: index.usage_for(selected, repos, 'overloaded'))
+            recorder.time('summary_table', label, lambda: summary_metrics(usage))
+            recorder.time('repository_options', label, lambda: ordered_unique(usage, 'source'))
+            methods = recorder.time('method_options', label, lambda: methods_with_args(usage))
+            recorder.time('usage_figures', label, lambda: [figure(usage) for figure in FIGURES.values()])
+            if methods:
+                method = methods[0]
+
+                def method_charts():
+                    selection = (selected, repos, 'all', method)
+                    return (method_configurations_figure(index.method_signatures(*selection), method),
+                            method_argument_figures(index.method_arg_types(*selection),
+                                                    index.method_arg_values(*selection), method))
+
+                recorder.time('method_charts', label, method_charts)
+
+
+def bench_clients(recorder, data_dir):
+    from common.dependency_index import CLIENT_EXTRACTORS, DependencyIndex, open_index, repo2dep_rows
+    from find_usage import find_client_repos_opt, find_popular_libs_cmake_submod
+
+    path = data_dir / 'repo2dep.json'
+    if not path.exists():
+        print(f"Generating {path}")
+        write_repo2dep(str(path))
+    dataset = 'repo2dep-25000'
+
+    recorder.time('repo2dep_json_load', dataset, lambda: json.loads(path.read_text()), repeat=1)
+    recorder.time('dependency_index_build', dataset,
+                  lambda: DependencyIndex.build(repo2dep_rows(path), str(data_dir / 'bench.index.sqlite')).close(),
+                  repeat=1)
+    index = open_index(path)
+    libraries = list(index.popularity(CLIENT_EXTRACTORS))[-100:]
+    recorder.time('find_client_repos_opt', f"{dataset} (100 libraries)",
+                  lambda: [find_client_repos_opt(index, library) for library in libraries])
+    recorder.time('find_popular_libs', dataset, lambda: find_popular_libs_cmake_submod(index))
+    index.close()
+
+
+def bench_files(recorder, data_dir, num_entries):
+    import find_usage
+
+    repo_path = data_dir / f"compile_commands-{num_entries}"
+    if not (repo_path / 'compile_commands.json').exists():
+        print(f"Generating {num_entries} compile commands in {repo_path}")
+        write_compile_commands(str(repo_path), num_entries)
+    dataset = f"compile_commands-{num_entries}"
+
+    find_usage.Config.LIBRARIES = {'zlib': r'zlib\.h'}
+    for prefilter in (False, True):
+        find_usage.Config.PREFILTER = prefilter
+        files = recorder.time('parse_compile_commands', f"{dataset} ({'prefilter' if prefilter else 'no prefilter'})",
+                              lambda: find_usage.parse_compile_commands(repo_path, ['zlib']))
+        print(f"{'':<32} {len(files or [])} of {num_entries} files kept")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Time ingestion, dashboard aggregation, client selection and '
+                                                 'compile command filtering on synthetic and example data')
+    parser.add_argument('--scale', type=str, default='small', choices=list(SCALES),
+                        help='Synthetic usage data size: 10k, 100k or 1M calls')
+    parser.add_argument('--suite', type=str, nargs='+', default=list(SUITES), choices=SUITES)
+    parser.add_argument('--repeat', type=int, default=3, help='Runs of each benchmark, the median is recorded')
+    parser.add_argument('--compile-commands', type=int, default=5000, help='Entries in the compile_commands.json')
+    parser.add_argument('--no-example-results', action='store_true', help='Only benchmark the synthetic data')
+    parser.add_argument('--data-dir', type=str, default=str(ROOT / 'benchmarks' / 'data'),
+                        help='Where generated data is kept between runs')
+    parser.add_argument('--results', type=str, default=str(ROOT / 'benchmarks' / 'results.jsonl'),
+                        help='JSONL every result is appended to and compared against')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    data_dir = Path(args.data_dir).resolve()
+    data_dir.mkdir(parents=True, exist_ok=True)
+    recorder = Recorder(os.path.abspath(args.results), args.repeat, args.scale)
+    # find_usage logs to file.log in the working directory
+    os.chdir(data_dir)
+
+    if 'ingest' in args.suite or 'interactions' in args.suite:
+        datasets = usage_datasets(data_dir, args.scale, not args.no_example_results)
+    if 'ingest' in args.suite:
+        bench_ingest(recorder, datasets)
+    if 'interactions' in args.suite:
+        bench_interactions(recorder, datasets)
+    if 'clients' in args.suite:
+        bench_clients(recorder, data_dir)
+    if 'files' in args.suite:
+        bench_files(recorder, data_dir, args.compile_commands)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,219 @@
+import os
+import time
+import fcntl
+import shutil
+import signal
+import logging
+import tempfile
+import contextlib
+import subprocess
+from pathlib import Path
+
+from git import Git, GitCommandError, Repo
+
+logger = logging.getLogger(__name__)
+
+LAST_USED = 'cache-last-used'
+FETCHED_AT = 'cache-fetched-at'
+SIZE = 'cache-size'
+
+
+def clone_url(url):
+    # --depth is ignored when cloning a plain local path, go through file:// instead
+    if '://' not in url and os.path.exists(url):
+        return Path(url).resolve().as_uri()
+    return url
+
+
+def mirror_name(url):
+    # Name mirrors like client repositories, e.g. https://github.com/google/googletest.git -> google@@googletest
+    parts = [part for part in url.rstrip('/').replace(':', '/').split('/') if part]
+    owner, name = parts[-2], parts[-1]
+    if name.endswith('.git'):
+        name = name[:-len('.git')]
+    return f"{owner}@@{name}"
+
+
+def time_left(timeout):
+    # Seconds the next network command may take, timeout returns them or None for no limit
+    return timeout() if timeout is not None else None
+
+
+def run_git(*args, cwd=None, timeout=None, **options):
+    """Run git with args and options in GitPython's keyword form, raising GitCommandError when it fails.
+
+    The command is killed once the seconds timeout returns run out. It runs in a process group of its own, fetches
+    over http go through remote helpers that keep its output open after git itself is killed.
+    """
+    command = ['git', *args, *Git().transform_kwargs(**options)]
+    seconds = time_left(timeout)
+    with tempfile.TemporaryFile() as stderr:
+        process = subprocess.Popen(command, cwd=cwd, stdout=subprocess.DEVNULL, stderr=stderr,
+                                   start_new_session=True)
+        try:
+            process.wait(seconds)
+        except subprocess.TimeoutExpired:
+            with contextlib.suppress(ProcessLookupError, PermissionError):
+                os.killpg(process.pid, signal.SIGKILL)
+            process.wait()
+            raise GitCommandError(command, f"killed after {seconds:.0f}s")
+        if process.returncode != 0:
+            stderr.seek(0)
+            raise GitCommandError(command, process.returncode, stderr.read())
+
+
+def submodule(repo, *args, timeout=None):
+    # Submodule clones from local mirrors go over the file transport, disabled by default since git 2.38.1
+    run_git('-c', 'protocol.file.allow=always', 'submodule', *args, cwd=repo.working_dir, timeout=timeout)
+
+
+def dir_size(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for f in files:
+            try:
+                total += os.lstat(os.path.join(root, f)).st_size
+            except OSError:
+                pass
+    return total
+
+
+class CloneCache:
+    """Local cache of bare repository mirrors that client checkouts are cloned from.
+
+    Each repository is fetched from its remote once into <root>/<name>.git and refreshed at most every
+    refresh_interval seconds. Checkouts are local clones of the mirror so repeat analyses stay on disk.
+    Mirrors are evicted least recently used first once the cache grows beyond max_bytes. A checkout may be given a
+    timeout, called before each command that talks to a remote for the seconds it may take.
+    """
+
+    def __init__(self, root, max_bytes=None, refresh_interval=24 * 3600, depth=1):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self.refresh_interval = refresh_interval
+        self.depth = depth
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def mirror_path(self, name):
+        return self.root / f"{name}.git"
+
+    @contextlib.contextmanager
+    def locked(self, name, blocking=True):
+        # File locks so concurrent threads and processes never fetch or evict the same mirror at once
+        with open(self.root / f"{name}.lock", 'w') as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+            except BlockingIOError:
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def fetch_options(self):
+        return {'depth': self.depth} if self.depth else {}
+
+    def fetch_age(self, mirror):
+        try:
+            return time.time() - os.path.getmtime(mirror / FETCHED_AT)
+        except OSError:
+            return float('inf')
+
+    def update_mirror(self, url, name, timeout=None):
+        mirror = self.mirror_path(name)
+        if not mirror.exists():
+            logger.info(f"Mirroring {name} from {url}")
+            try:
+                # Not Repo.clone_from, which can't kill a clone that runs out of time
+                run_git('clone', clone_url(url), str(mirror), timeout=timeout, bare=True, **self.fetch_options())
+                repo = Repo(mirror)
+            except Exception:
+                shutil.rmtree(mirror, ignore_errors=True)
+                raise
+            # Bare clones have no fetch refspec, track the default branch so refreshes update it
+            head = repo.git.symbolic_ref('HEAD')
+            repo.git.config('remote.origin.fetch', f"+{head}:{head}")
+            # Allow partial clones of the mirror over file://
+            repo.git.config('uploadpack.allowFilter', 'true')
+        elif self.refresh_interval is not None and self.fetch_age(mirror) > self.refresh_interval:
+            logger.info(f"Refreshing mirror of {name}")
+            run_git('fetch', 'origin', cwd=mirror, timeout=timeout, prune=True, **self.fetch_options())
+        else:
+            return mirror
+
+        (mirror / FETCHED_AT).touch()
+        (mirror / SIZE).write_text(str(dir_size(mirror)))
+        return mirror
+
+    def checkout(self, url, name, dest, submodules=False, timeout=None):
+        """Check out the default branch of url into dest, going through the local mirror."""
+        with self.locked(name):
+            mirror = self.update_mirror(url, name, timeout)
+            (mirror / LAST_USED).touch()
+            # A local clone hard links the mirror's objects, so the checkout survives eviction of the mirror
+            repo = Repo.clone_from(str(mirror), dest)
+        # Point origin back at the real remote so relative submodule URLs resolve against it
+        repo.remote().set_url(url)
+        if submodules:
+            self.checkout_submodules(repo, timeout)
+        self.evict(keep=name)
+        return repo
+
+    def checkout_submodules(self, repo, timeout=None):
+        """Initialise submodules recursively, cloning each one from its own mirror in the cache."""
+        git = repo.git
+        if not (Path(repo.working_dir) / '.gitmodules').exists():
+            return
+        submodule(repo, 'init')
+        try:
+            paths = git.config('-f', '.gitmodules', '--get-regexp', r'^submodule\..*\.path$').splitlines()
+        except GitCommandError:
+            return
+
+        for line in paths:
+            key, path = line.split(' ', 1)
+            name = key[len('submodule.'):-len('.path')]
+            url = git.config('--get', f'submodule.{name}.url')
+            try:
+                with self.locked(mirror_name(url)):
+                    mirror = self.update_mirror(url, mirror_name(url), timeout)
+                    (mirror / LAST_USED).touch()
+                    git.config(f'submodule.{name}.url', str(mirror))
+                    submodule(repo, 'update', '--', path, timeout=timeout)
+            except GitCommandError as e:
+                # The pinned commit may not be in the shallow mirror, fetch it from the remote instead
+                logger.info(f"Fetching submodule {path} from {url}: {e}")
+                git.config(f'submodule.{name}.url', url)
+                submodule(repo, 'update', '--depth', '1', '--', path, timeout=timeout)
+
+            sub_repo = Repo(Path(repo.working_dir) / path)
+            sub_repo.remote().set_url(url)
+            self.checkout_submodules(sub_repo, timeout)
+
+    def mirrors(self):
+        for mirror in self.root.glob('*.git'):
+            try:
+                size = int((mirror / SIZE).read_text())
+                last_used = os.path.getmtime(mirror / LAST_USED)
+            except (OSError, ValueError):
+                size, last_used = dir_size(mirror), 0
+            yield mirror.name[:-len('.git')], size, last_used
+
+    def evict(self, keep=None):
+        if self.max_bytes is None:
+            return
+        mirrors = sorted(self.mirrors(), key=lambda item: item[2])
+        total = sum(size for _, size, _ in mirrors)
+        for name, size, _ in mirrors:
+            if total <= self.max_bytes:
+                break
+            if name == keep:
+                continue
+            # Mirrors in use by another worker are skipped rather than waited on
+            with self.locked(name, blocking=False) as acquired:
+                if not acquired:
+                    continue
+                logger.info(f"Evicting mirror of {name} ({size} bytes)")
+                shutil.rmtree(self.mirror_path(name), ignore_errors=True)
+                total -= size
@@ -0,0 +1,185 @@
+import os
+import sys
+import json
+import sqlite3
+from pathlib import Path
+
+# Run as a script the repository root is not on the path
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from common.result_store import ResultStore
+
+# Dependency evidence find_usage can build against
+CLIENT_EXTRACTORS = ('cmake', 'submod')
+
+
+def is_result_store(path):
+    return Path(path).suffix in ('.sqlite', '.db')
+
+
+def source_signature(path):
+    path = Path(path)
+    if is_result_store(path):
+        # Writes to a store in WAL mode don't touch the database file until a checkpoint
+        with ResultStore(path) as store:
+            count, scanned_at = store.conn.execute("SELECT COUNT(*), MAX(scanned_at) FROM results").fetchone()
+        return int((scanned_at or 0) * 1e9), count
+    if path.is_dir():
+        # Directory mtimes change whenever a result file is added or removed
+        stat = path.stat()
+        return stat.st_mtime_ns, sum(1 for _ in os.scandir(path))
+    stat = path.stat()
+    return stat.st_mtime_ns, stat.st_size
+
+
+def repo2dep_rows(path):
+    """(library, repo, extractor_type, version) of every dependency in a repo2dep.json file."""
+    with open(path, 'r') as f:
+        data = json.load(f)
+    for repo, dependencies in data.items():
+        if not isinstance(dependencies, dict):
+            continue
+        for library, occurrences in dependencies.items():
+            if not occurrences:
+                # Keep libraries listed without evidence, find_client_repos counts them
+                yield library, repo, None, None
+            for occurrence in occurrences or []:
+                yield library, repo, occurrence.get('extractor_type'), occurrence.get('version')
+
+
+def results_rows(path):
+    """(library, repo, extractor_type, version) of every dependency in a directory of ccscanner results."""
+    for entry in sorted(os.scandir(path), key=lambda entry: os.path.splitext(entry.name)[0]):
+        if not entry.name.endswith('.json'):
+            continue
+        try:
+            with open(entry.path, 'r') as f:
+                result = json.load(f)
+        except (OSError, ValueError):
+            continue
+        yield from scan_rows(result)
+
+
+def store_rows(path):
+    """(library, repo, extractor_type, version) of every dependency in a result store."""
+    with ResultStore(path) as store:
+        for name, result in store.scan():
+            yield from scan_rows(result, name)
+
+
+def scan_rows(result, repo=None):
+    repo = repo or result.get('target')
+    for extractor in result.get('extractors') or []:
+        for dep in extractor.get('deps') or []:
+            library = dep.get('unified_name') or dep.get('depname')
+            if library:
+                yield library, repo, dep.get('extractor_type') or extractor.get('type'), dep.get('version')
+
+
+class DependencyIndex:
+    """Inverted index of a dependency dataset, library -> (client repository, extractor type, version).
+
+    Built once from repo2dep.json or a directory of ccscanner results into a SQLite file next to it and rebuilt
+    when the source changes, so lookups don't load the whole dataset.
+    """
+
+    def __init__(self, path):
+        self.path = str(path)
+        self.conn = sqlite3.connect(self.path)
+
+    @classmethod
+    def build(cls, rows, path, signature=None):
+        # Built into a temporary file and swapped in, so readers never see a partial index
+        tmp_path = str(path) + '.tmp'
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        conn = sqlite3.connect(tmp_path)
+        conn.execute("CREATE TABLE dependencies (library TEXT NOT NULL, repo TEXT NOT NULL, extractor_type TEXT, "
+                     "version TEXT)")
+        conn.execute("CREATE TABLE source (mtime_ns INTEGER, size INTEGER)")
+        conn.executemany("INSERT INTO dependencies VALUES (?, ?, ?, ?)", rows)
+        conn.execute("CREATE INDEX dependencies_library ON dependencies (library, extractor_type)")
+        if signature is not None:
+            conn.execute("INSERT INTO source VALUES (?, ?)", signature)
+        conn.commit()
+        conn.close()
+        os.replace(tmp_path, path)
+        return cls(path)
+
+    def signature(self):
+        try:
+            return self.conn.execute("SELECT mtime_ns, size FROM source").fetchone()
+        except sqlite3.DatabaseError:
+            return None
+
+    def clients(self, library, extractor_types=None):
+        """Client repositories of library, in dataset order, optionally only those with evidence of extractor_types."""
+        query = "SELECT repo FROM dependencies WHERE library = ?"
+        params = [library]
+        if extractor_types is not None:
+            query += f" AND extractor_type IN ({','.join('?' * len(extractor_types))})"
+            params += list(extractor_types)
+        rows = self.conn.execute(query + " GROUP BY repo ORDER BY MIN(rowid)", params).fetchall()
+        return [repo for repo, in rows]
+
+    def clients_multi(self, libraries, extractor_types=None):
+        """Union of the clients of several libraries, mapping each client to the libraries it uses."""
+        clients = {}
+        for library in libraries:
+            for repo in self.clients(library, extractor_types):
+                clients.setdefault(repo, []).append(library)
+        return clients
+
+    def libraries(self):
+        return {library for library, in self.conn.execute("SELECT DISTINCT library FROM dependencies")}
+
+    def popularity(self, extractor_types=None):
+        """Number of client repositories of every library, least used first."""
+        query = "SELECT library, COUNT(DISTINCT repo) FROM dependencies"
+        params = []
+        if extractor_types is not None:
+            query += f" WHERE extractor_type IN ({','.join('?' * len(extractor_types))})"
+            params = list(extractor_types)
+        rows = self.conn.execute(query + " GROUP BY library ORDER BY COUNT(DISTINCT repo), MIN(rowid)",
+                                 params).fetchall()
+        return dict(rows)
+
+    def close(self):
+        self.conn.close()
+
+
+def open_index(source, index_path=None):
+    """Open the index of repo2dep.json, a result store or a results directory, (re)building it when stale."""
+    source = Path(source)
+    # Opening a missing result store would create an empty one and every library would silently have no clients
+    if not source.exists():
+        raise FileNotFoundError(f"No such dependency dataset: '{source}'")
+    if index_path is None:
+        index_path = source.with_name(source.name + '.index.sqlite')
+    signature = source_signature(source)
+    if os.path.exists(index_path):
+        index = DependencyIndex(index_path)
+        if index.signature() == signature:
+            return index
+        index.close()
+    if is_result_store(source):
+        rows = store_rows(source)
+    elif source.is_dir():
+        rows = results_rows(source)
+    else:
+        rows = repo2dep_rows(source)
+    return DependencyIndex.build(rows, index_path, signature)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python dependency_index.py <repo2dep.json|results.sqlite|results_dir> [library_name]")
+    elif not os.path.exists(sys.argv[1]):
+        sys.exit(f"No such dependency dataset: '{sys.argv[1]}'")
+    else:
+        index = open_index(sys.argv[1])
+        if len(sys.argv) > 2:
+            print("\n".join(index.clients(sys.argv[2], CLIENT_EXTRACTORS)))
+        else:
+            for library, count in index.popularity(CLIENT_EXTRACTORS).items():
+                print(f"{library}\t{count}")
+        index.close()
@@ -0,0 +1,137 @@
+import os
+import json
+import time
+import zlib
+import sqlite3
+import argparse
+import threading
+
+
+class ResultStore:
+    """ccscanner results of every scanned repository, packed into a single SQLite file.
+
+    Each result is stored as zlib compressed json under the repository name (owner@@name), a rescan replaces the
+    previous result. The database is in WAL mode so scan worker processes can each open the store and write
+    concurrently while it is read. Within a process one store may be shared by threads, every use of its
+    connection is serialised by a lock.
+    """
+
+    def __init__(self, path, timeout=60):
+        self.path = str(path)
+        self.lock = threading.Lock()
+        # Shared with the threads discovery hands search results to, the lock keeps them off it at the same time
+        self.conn = sqlite3.connect(self.path, timeout=timeout, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS results (name TEXT PRIMARY KEY, result BLOB NOT NULL, "
+                          "scanned_at REAL NOT NULL)")
+        self.conn.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def put_json(self, name, text):
+        blob = zlib.compress(text.encode())
+        with self.lock, self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?)", (name, blob, time.time()))
+
+    def put(self, name, result):
+        self.put_json(name, json.dumps(result))
+
+    def get(self, name):
+        with self.lock:
+            row = self.conn.execute("SELECT result FROM results WHERE name = ?", (name,)).fetchone()
+        return json.loads(zlib.decompress(row[0])) if row is not None else None
+
+    def __contains__(self, name):
+        with self.lock:
+            return self.conn.execute("SELECT 1 FROM results WHERE name = ?", (name,)).fetchone() is not None
+
+    def __len__(self):
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+
+    def scanned_times(self):
+        """Time each repository's result was stored at, or the file's mtime for imported results."""
+        with self.lock:
+            return dict(self.conn.execute("SELECT name, scanned_at FROM results"))
+
+    def names(self):
+        with self.lock:
+            return [name for name, in self.conn.execute("SELECT name FROM results ORDER BY name")]
+
+    def scan(self, batch_size=256):
+        """(name, result) of every stored repository, in name order."""
+        with self.lock:
+            cursor = self.conn.execute("SELECT name, result FROM results ORDER BY name")
+        while True:
+            # The lock is only held per batch, so other threads can use the store while results are consumed
+            with self.lock:
+                rows = cursor.fetchmany(batch_size)
+            if not rows:
+                return
+            for name, blob in rows:
+                yield name, json.loads(zlib.decompress(blob))
+
+    def import_directory(self, path):
+        """Pack a directory of <owner>@@<name>.json result files, returns the number imported."""
+        count = 0
+        with self.lock, self.conn:
+            for entry in sorted(os.scandir(path), key=lambda entry: os.path.splitext(entry.name)[0]):
+                if not entry.name.endswith('.json'):
+                    continue
+                with open(entry.path, 'r') as f:
+                    text = f.read()
+                try:
+                    json.loads(text)
+                except ValueError:
+                    continue
+                self.conn.execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?)",
+                                  (entry.name[:-len('.json')], zlib.compress(text.encode()), entry.stat().st_mtime))
+                count += 1
+        return count
+
+    def export_repo2dep(self, path):
+        """Write the repo2dep.json layout find_usage reads: repo -> library -> [dependency evidence]."""
+        repo2dep = {}
+        for name, result in self.scan():
+            dependencies = {}
+            for extractor in result.get('extractors') or []:
+                for dep in extractor.get('deps') or []:
+                    library = dep.get('unified_name') or dep.get('depname')
+                    if library:
+                        dependencies.setdefault(library, []).append(dep)
+            repo2dep[name] = dependencies
+        tmp_path = str(path) + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(repo2dep, f)
+        os.replace(tmp_path, path)
+        return len(repo2dep)
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Pack, inspect and export ccscanner results')
+    parser.add_argument('store', type=str, help='Result store, e.g. results.sqlite')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('import', help='Pack a directory of result json files').add_argument('directory')
+    subparsers.add_parser('export', help='Write repo2dep.json for find_usage').add_argument('repo2dep')
+    subparsers.add_parser('show', help='Print the result of a repository').add_argument('name')
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    with ResultStore(args.store) as store:
+        if args.command == 'import':
+            print(f"Imported {store.import_directory(args.directory)} results into {args.store}")
+        elif args.command == 'export':
+            print(f"Exported {store.export_repo2dep(args.repo2dep)} repositories to {args.repo2dep}")
+        else:
+            print(json.dumps(store.get(args.name), indent=2))
@@ -1,137 +1,155 @@
 import os
+import sys
 import time
+import argparse
+import functools
 
-import requests
 import shutil
+from pathlib import Path
 from git import Repo
 import logging
 import json
 from ccscanner import scanner
-from requests.exceptions import HTTPError, ConnectionError, Timeout, RequestException
-from concurrent.futures import ThreadPoolExecutor
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from common.clone_cache import CloneCache
+from common.result_store import ResultStore
+from scan_manifest import ScanManifest, repo_version
+from scan_pipeline import ScanPipeline
+from search_frontier import GITHUB_GRAPHQL_URL, discover
 
 # Create a custom logger
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
 # Create handlers
-f_handler = logging.FileHandler('file.log', mode='w')
+# Opened on first use, scan worker processes that re-import this module must not truncate it
+f_handler = logging.FileHandler('file.log', mode='w', delay=True)
 f_handler.setLevel(logging.INFO)
 
 # Create formatters and add it to handlers
 f_format = logging.Formatter('%(asctime)s:%(levelname)s:%(name)s:%(message)s')
 f_handler.setFormatter(f_format)
 
-# Add handlers to the logger
+# Add handlers to the logger, and to the loggers of the modules used
 logger.addHandler(f_handler)
+for module in ('search_frontier', 'scan_pipeline', 'common.clone_cache'):
+    logging.getLogger(module).setLevel(logging.INFO)
+    logging.getLogger(module).addHandler(f_handler)
+
+# Optional shared cache of bare mirrors repositories are checked out from, set CLONE_CACHE_DIR to enable
+CLONE_CACHE = None
 
 
-def save_js(content, path):
-    with open(path, 'w') as save_f:
-        json.dump(content, save_f)
-
-
-def make_query(after_cursor=None, star_range=">3000", lang="C++"):
-    return """
-query {
-  search(query: "language:LANG stars:RANGE", type: REPOSITORY, first: 100, after:AFTER) {
-    repositoryCount
-    edges {
-      node {
-        ... on Repository {
-          nameWithOwner
-          url
-          stargazerCount
-        }
-      }
-    }    
-    pageInfo {
-      endCursor
-      hasNextPage
-    }
-  }
-}
-""".replace(
-        "AFTER", '"{}"'.format(after_cursor) if after_cursor else "null"
-    ).replace("LANG", '{}'.format(lang)).replace("RANGE", str(star_range))
-
-
-def get_response(url, headers, language, star_range_str, curr_cursor):
-    while True:
-        try:
-            logger.info(f"Querying Language:{language}, Range: {star_range_str}, Cursor:{curr_cursor}")
-            response = requests.post(url, json={"query": make_query(lang=language, star_range=star_range_str,
-                                                                    after_cursor=curr_cursor)}, headers=headers)
-            response.raise_for_status()
-            return response.json()
-        except (HTTPError, ConnectionError, Timeout, RequestException) as error:
-            logger.error(f"Request failed due to {type(error).__name__}: {error}")
-
-
-def clone_and_scan_repo(repo):
+def clone_repo(repo):
     name = repo["node"]["nameWithOwner"].replace("/", "@@")
     r_url = repo["node"]["url"]
     stars = repo["node"]["stargazerCount"]
     if not os.path.isdir(name):
         attempt = 0
         # Attempt to re-download repositories if network errors occurs
-        while attempt < 10:
+        while True:
             try:
                 logger.info(f"Cloning {name} ({stars} stars) from {r_url} (attempt: {attempt})")
-                Repo.clone_from(r_url, name, multi_options=["--depth 1"])
+                if CLONE_CACHE is not None:
+                    CLONE_CACHE.checkout(r_url, name, name)
+                else:
+                    Repo.clone_from(r_url, name, multi_options=["--depth 1"])
                 break
             except Exception as e:
                 logger.error(f"Failed to clone repo: {e}")
+                shutil.rmtree(name, ignore_errors=True)
                 attempt = attempt + 1
+                if attempt >= 10:
+                    raise
                 # Sleep thread to avoid thrashing
                 time.sleep(10 * attempt)
+    return name
+
+
+# Runs in a scan worker process, the parent logs the outcome
+def scan_repo(name, store_path):
+    start = time.perf_counter()
+    try:
+        ccscan = scanner.scanner(name)
+        # Serialised once straight into the store, workers write concurrently
+        with ResultStore(store_path) as store:
+            store.put_json(name, json.dumps(ccscan, default=lambda o: o.__dict__))
+    finally:
+        # Remove scanned repository
+        shutil.rmtree(name, ignore_errors=True)
+    return time.perf_counter() - start
 
-    logger.info(f"Scanning {name} ({stars} stars)")
-    ccscan = scanner.scanner(name)
-    res = json.loads(json.dumps(ccscan, default=lambda o: o.__dict__))
-    save_js(res, os.path.join("results/", name) + ".json")
-    # Remove scanned repository
-    shutil.rmtree(name)
-
-# Query API for repositories within a star range
-def find_repos(url, headers, language, star_range, executor, curr_cursor=None):
-    has_next_page = True
-    while has_next_page:
-        # Query API for repositories in star range
-        response = get_response(url, headers, language, star_range, curr_cursor)
-
-        has_next_page = response["data"]["search"]["pageInfo"]["hasNextPage"]
-        # get next page cursor for pagination
-        curr_cursor = response["data"]["search"]["pageInfo"]["endCursor"]
-        data = response["data"]["search"]["edges"]
-        # submit clone and scan job to thread pool for each repository
-        for repo in data:
-            executor.submit(clone_and_scan_repo, repo)
-
-
-def main(token, url, languages):
+
+def main(token, url, languages, min_stars=101, concurrency=4, clone_workers=4, scan_workers=None, manifest=None,
+         incremental=False, store_path='results.sqlite'):
     headers = {"Authorization": f"Bearer {token}"}
-    # Initialise thread pool with cpu_count number of workers
-    with ThreadPoolExecutor() as executor:
-        # Search schedule needed to overcome API limitations and rate limiting
-        for language in languages:
-            star_greater = ">3000"
-            find_repos(url, headers, language, star_greater, executor)
-            for star_count in range(3000, 500, -100):
-                range_query = f"{star_count - 99}..{star_count}"
-                find_repos(url, headers, language, range_query, executor)
-            for star_count in range(500, 150, -10):
-                range_query = f"{star_count - 9}..{star_count}"
-                find_repos(url, headers, language, range_query, executor)
-            for star_count in range(150, 100, -1):
-                find_repos(url, headers, language, str(star_count), executor)
+    skipped = 0
+    store = ResultStore(store_path)
+    if incremental and manifest is not None:
+        # Results stored before there was a manifest, e.g. an imported results/ directory, count as scanned then
+        seeded = manifest.seed(store.scanned_times())
+        if seeded:
+            logger.info(f"Seeded the manifest with {seeded} results from {store_path}")
+
+    def on_scanned(repo):
+        if manifest is not None:
+            manifest.update(repo["node"]["nameWithOwner"], *repo_version(repo))
+
+    # Clone in threads, scan in cpu_count processes, discovery blocks while the job queue is full
+    scan = functools.partial(scan_repo, store_path=store_path)
+    with ScanPipeline(clone_repo, scan, clone_workers, scan_workers, on_scanned=on_scanned) as pipeline:
+        def submit(repos):
+            nonlocal skipped
+            for repo in repos:
+                # Incremental runs only rescan repositories whose default branch changed since the last scan
+                if (incremental and manifest is not None
+                        and repo["node"]["nameWithOwner"].replace("/", "@@") in store
+                        and manifest.is_current(repo["node"]["nameWithOwner"], *repo_version(repo))):
+                    skipped += 1
+                    continue
+                pipeline.submit(repo)
+
+        # Star ranges are split until each can be paged within the search API's 1000 result limit
+        discover(url, headers, languages, submit, min_stars, concurrency=concurrency)
+
+    logger.info(f"{len(store)} results in {store_path}")
+    store.close()
+    if manifest is not None:
+        manifest.save()
+    if incremental:
+        logger.info(f"Skipped {skipped} repositories unchanged since they were last scanned")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Discover C/C++ repositories on GitHub and scan their dependencies')
+    # api endpoint, GITHUB_GRAPHQL_URL can point at another server e.g. a local mock
+    parser.add_argument('--url', type=str, default=os.environ.get('GITHUB_GRAPHQL_URL', GITHUB_GRAPHQL_URL),
+                        help='GraphQL endpoint')
+    # languages to select repositories from.
+    parser.add_argument('--languages', type=str, nargs='+', default=["C++", "C"])
+    parser.add_argument('--min-stars', type=int, default=101)
+    parser.add_argument('--concurrency', type=int, default=4, help='Concurrent search requests')
+    parser.add_argument('--clone-workers', type=int, default=4)
+    parser.add_argument('--scan-workers', type=int, default=None, help='ccscanner processes (default: cpu count)')
+    parser.add_argument('--incremental', action='store_true',
+                        help='Only clone and scan repositories that changed since they were recorded in the manifest')
+    parser.add_argument('--manifest', type=str, default='manifest.json',
+                        help='Commit each repository was scanned at, updated on every run')
+    parser.add_argument('--store', type=str, default='results.sqlite',
+                        help='Packed ccscanner results, export repo2dep.json with common/result_store.py')
+    return parser.parse_args()
 
 
 if __name__ == '__main__':
+    args = parse_args()
     # set the GITHUB_TOKEN environment variable to run tool.
     token = os.environ.get('GITHUB_TOKEN')
-    # api endpoint
-    url = "https://api.github.com/graphql"
-    # languages to select repositories from.
-    languages = ["C++", "C"]
-    main(token, url, languages)
+    cache_dir = os.environ.get('CLONE_CACHE_DIR')
+    if cache_dir:
+        max_gb = os.environ.get('CLONE_CACHE_MAX_GB')
+        CLONE_CACHE = CloneCache(cache_dir, int(float(max_gb) * 1024 ** 3) if max_gb else None)
+    # A full run rescans everything but still records what it scanned for later incremental runs
+    manifest = ScanManifest(args.manifest)
+    main(token, args.url, args.languages, args.min_stars, args.concurrency, args.clone_workers, args.scan_workers,
+         manifest, args.incremental, args.store)
@@ -0,0 +1,84 @@
+import os
+import json
+import time
+import threading
+from datetime import datetime
+
+
+def repo_version(repo):
+    # Default branch HEAD and last push of a search result, the HEAD is missing for empty repositories
+    node = repo["node"]
+    target = (node.get("defaultBranchRef") or {}).get("target") or {}
+    return target.get("oid"), node.get("pushedAt")
+
+
+def timestamp(pushed_at):
+    # pushedAt is ISO 8601 in UTC, e.g. 2024-01-31T12:00:00Z
+    return datetime.fromisoformat(pushed_at.replace('Z', '+00:00')).timestamp()
+
+
+class ScanManifest:
+    """Default branch commit and pushedAt each repository was last scanned at, kept in a json file.
+
+    A repository is current when the search result reports the same commit, or the same pushedAt when the commit
+    is unknown, so incremental runs only clone and scan repositories that changed. Entries seeded from existing
+    results only know when the result was written, the repository is current when it was not pushed since.
+    """
+
+    def __init__(self, path, save_every=100):
+        self.path = path
+        self.save_every = save_every
+        self.lock = threading.Lock()
+        self.unsaved = 0
+        try:
+            with open(path, 'r') as f:
+                self.entries = json.load(f)
+        except (OSError, ValueError):
+            self.entries = {}
+
+    def is_current(self, name, sha, pushed_at):
+        with self.lock:
+            entry = self.entries.get(name)
+        if entry is None:
+            return False
+        if sha is not None and entry.get("sha") is not None:
+            return sha == entry["sha"]
+        if entry.get("seeded"):
+            return pushed_at is not None and timestamp(pushed_at) <= entry["scannedAt"]
+        return pushed_at is not None and pushed_at == entry.get("pushedAt")
+
+    def seed(self, scanned_times):
+        """Add an entry for every <owner>@@<name> result scanned at the given time that the manifest lacks.
+
+        Lets the first incremental run after results were produced without a manifest skip what is still current,
+        returns the number of entries added.
+        """
+        added = 0
+        with self.lock:
+            for name, scanned_at in scanned_times.items():
+                name = name.replace("@@", "/", 1)
+                if name not in self.entries:
+                    self.entries[name] = {"sha": None, "pushedAt": None, "scannedAt": scanned_at, "seeded": True}
+                    added += 1
+            if added:
+                self.write()
+        return added
+
+    def update(self, name, sha, pushed_at):
+        with self.lock:
+            self.entries[name] = {"sha": sha, "pushedAt": pushed_at, "scannedAt": time.time()}
+            self.unsaved += 1
+            if self.unsaved >= self.save_every:
+                self.write()
+
+    def save(self):
+        with self.lock:
+            self.write()
+
+    def write(self):
+        # Written to a temporary file and swapped in, so an interrupted run leaves the previous manifest intact
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.entries, f)
+        os.replace(tmp_path, self.path)
+        self.unsaved = 0
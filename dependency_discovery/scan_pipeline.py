@@ -0,0 +1,111 @@
+import os
+import time
+import queue
+import logging
+import threading
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+
+class ScanPipeline:
+    """Bounded clone then scan pipeline for discovered repositories.
+
+    submit() blocks once queue_size repositories are waiting, so discovery can't run arbitrarily far ahead.
+    clone_workers threads clone repositories and hand them to a pool of scan_workers processes, at most
+    2 * scan_workers clones wait on disk for a scan. The outcome and any exception of every job is recorded and
+    on_scanned, when given, is called with each successfully scanned repository.
+    """
+
+    def __init__(self, clone, scan, clone_workers=4, scan_workers=None, queue_size=64, on_scanned=None):
+        self.clone = clone
+        self.scan = scan
+        self.on_scanned = on_scanned
+        scan_workers = scan_workers or os.cpu_count() or 1
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.scan_slots = threading.BoundedSemaphore(2 * scan_workers)
+        self.scan_pool = ProcessPoolExecutor(max_workers=scan_workers)
+        self.lock = threading.Lock()
+        self.outcomes = Counter()
+        self.errors = []
+        self.clone_seconds = 0.0
+        self.scan_seconds = 0.0
+        self.start = time.perf_counter()
+        self.threads = [threading.Thread(target=self.clone_worker, daemon=True) for _ in range(clone_workers)]
+        for thread in self.threads:
+            thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def submit(self, repo):
+        self.queue.put(repo)
+
+    def record(self, name, outcome, error=None):
+        with self.lock:
+            self.outcomes[outcome] += 1
+            if error is not None:
+                self.errors.append((name, outcome, error))
+                logger.error(f"{outcome} {name}: {type(error).__name__}: {error}")
+
+    def clone_worker(self):
+        while True:
+            repo = self.queue.get()
+            if repo is None:
+                return
+            # Wait for a scan slot before cloning, so clones don't pile up on disk behind the scanners
+            self.scan_slots.acquire()
+            name = repo["node"]["nameWithOwner"]
+            start = time.perf_counter()
+            try:
+                path = self.clone(repo)
+            except Exception as e:
+                self.scan_slots.release()
+                self.record(name, 'clone_failed', e)
+                continue
+            with self.lock:
+                self.clone_seconds += time.perf_counter() - start
+
+            try:
+                future = self.scan_pool.submit(self.scan, path)
+            except Exception as e:
+                self.scan_slots.release()
+                self.record(name, 'scan_failed', e)
+                continue
+            future.add_done_callback(lambda future, repo=repo: self.scan_done(repo, future))
+
+    def scan_done(self, repo, future):
+        name = repo["node"]["nameWithOwner"]
+        self.scan_slots.release()
+        try:
+            seconds = future.result()
+        except Exception as e:
+            self.record(name, 'scan_failed', e)
+            return
+        with self.lock:
+            self.scan_seconds += seconds
+        logger.info(f"Scanned {name} in {seconds:.1f}s")
+        self.record(name, 'scanned')
+        if self.on_scanned is not None:
+            self.on_scanned(repo)
+
+    def close(self):
+        for _ in self.threads:
+            self.queue.put(None)
+        for thread in self.threads:
+            thread.join()
+        self.scan_pool.shutdown(wait=True)
+        self.report()
+
+    def report(self):
+        elapsed = time.perf_counter() - self.start
+        total = sum(self.outcomes.values())
+        rate = total / elapsed if elapsed > 0 else float('inf')
+        logger.info(f"Processed {total} repositories in {elapsed:.0f}s ({rate * 3600:.0f}/hour): "
+                    f"{dict(self.outcomes)}, clone time {self.clone_seconds:.0f}s, scan time {self.scan_seconds:.0f}s")
+        for name, outcome, error in self.errors:
+            logger.info(f"  {outcome}: {name}: {type(error).__name__}: {error}")
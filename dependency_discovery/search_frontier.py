@@ -0,0 +1,202 @@
+import time
+import random
+import asyncio
+import logging
+
+import requests
+from requests.exceptions import RequestException
+
+logger = logging.getLogger(__name__)
+
+GITHUB_GRAPHQL_URL = "https://api.github.com/graphql"
+# The search API returns at most 1000 results for a query, however many repositories match it
+MAX_RESULTS = 1000
+PAGE_SIZE = 100
+
+
+def make_query(after_cursor=None, star_range=">3000", lang="C++"):
+    return """
+query {
+  search(query: "language:LANG stars:RANGE", type: REPOSITORY, first: PAGE_SIZE, after:AFTER) {
+    repositoryCount
+    edges {
+      node {
+        ... on Repository {
+          nameWithOwner
+          url
+          stargazerCount
+          pushedAt
+          defaultBranchRef {
+            target {
+              oid
+            }
+          }
+        }
+      }
+    }
+    pageInfo {
+      endCursor
+      hasNextPage
+    }
+  }
+}
+""".replace(
+        "AFTER", '"{}"'.format(after_cursor) if after_cursor else "null"
+    ).replace("LANG", '{}'.format(lang)).replace("RANGE", str(star_range)).replace("PAGE_SIZE", str(PAGE_SIZE))
+
+
+def star_range(low, high=None):
+    # GitHub search syntax for low <= stars <= high, high=None is unbounded
+    if high is None:
+        return f">={low}"
+    if low == high:
+        return str(low)
+    return f"{low}..{high}"
+
+
+class RateLimitBudget:
+    """Remaining API rate limit as last reported in the response headers.
+
+    Requests are counted against the budget as they are sent, once it drops to the reserve every request waits
+    for the reset time reported by the API.
+    """
+
+    def __init__(self, reserve=10):
+        self.reserve = reserve
+        self.remaining = None
+        self.reset_at = 0.0
+        self.lock = asyncio.Lock()
+
+    def update(self, headers):
+        remaining = headers.get('X-RateLimit-Remaining')
+        reset_at = headers.get('X-RateLimit-Reset')
+        if remaining is not None and reset_at is not None:
+            self.remaining = int(remaining)
+            self.reset_at = float(reset_at)
+
+    async def acquire(self):
+        async with self.lock:
+            if self.remaining is not None and self.remaining <= self.reserve:
+                delay = self.reset_at - time.time()
+                if delay > 0:
+                    logger.info(f"Rate limit budget exhausted, waiting {delay:.0f}s for reset")
+                    await asyncio.sleep(delay + 1)
+                # Unknown until the next response reports it again
+                self.remaining = None
+            elif self.remaining is not None:
+                self.remaining -= 1
+
+
+class SearchFrontier:
+    """Concurrently pages GitHub repository searches over star ranges.
+
+    A range matching more repositories than the search API returns is split in two until every range can be paged
+    completely. Each page of results is passed to on_repos, which is run in a thread so it may block.
+    """
+
+    def __init__(self, url, headers, on_repos, concurrency=4, reserve=10, max_attempts=8, max_backoff=300):
+        self.url = url
+        self.headers = headers
+        self.on_repos = on_repos
+        self.concurrency = concurrency
+        self.reserve = reserve
+        self.max_attempts = max_attempts
+        self.max_backoff = max_backoff
+        self.seen = set()
+        self.requests = 0
+        self.failed = 0
+
+    def backoff(self, attempt):
+        # Exponential backoff with jitter so concurrent ranges don't retry in lockstep
+        return min(self.max_backoff, 2 ** attempt) * (0.5 + random.random() / 2)
+
+    def post(self, query):
+        return requests.post(self.url, json={"query": query}, headers=self.headers, timeout=60)
+
+    async def query(self, language, stars, cursor=None):
+        loop = asyncio.get_running_loop()
+        for attempt in range(self.max_attempts):
+            await self.budget.acquire()
+            async with self.semaphore:
+                logger.info(f"Querying Language:{language}, Range: {stars}, Cursor:{cursor}")
+                self.requests += 1
+                try:
+                    response = await loop.run_in_executor(
+                        None, self.post, make_query(lang=language, star_range=stars, after_cursor=cursor))
+                except RequestException as error:
+                    logger.error(f"Request failed due to {type(error).__name__}: {error}")
+                    wait = self.backoff(attempt)
+                else:
+                    self.budget.update(response.headers)
+                    if response.status_code in (403, 429) or response.status_code >= 500:
+                        # Secondary rate limits ask to wait with Retry-After
+                        retry_after = response.headers.get('Retry-After')
+                        wait = float(retry_after) if retry_after else self.backoff(attempt)
+                        logger.error(f"Request failed with status {response.status_code}, retrying in {wait:.0f}s")
+                    elif response.status_code >= 400:
+                        logger.error(f"Request failed with status {response.status_code}: {response.text}")
+                        break
+                    else:
+                        data = response.json()
+                        if data.get('data') and data['data'].get('search'):
+                            return data['data']['search']
+                        logger.error(f"Query failed: {data.get('errors')}")
+                        wait = self.backoff(attempt)
+            await asyncio.sleep(wait)
+
+        self.failed += 1
+        logger.error(f"Giving up on Language:{language}, Range: {stars}, Cursor:{cursor}")
+        return None
+
+    async def deliver(self, search):
+        repos = []
+        for repo in search["edges"]:
+            name = repo["node"]["nameWithOwner"]
+            # Star counts change while paging, a repository can show up in two ranges
+            if name not in self.seen:
+                self.seen.add(name)
+                repos.append(repo)
+        if repos:
+            await asyncio.get_running_loop().run_in_executor(None, self.on_repos, repos)
+
+    async def search_range(self, language, low, high=None):
+        stars = star_range(low, high)
+        search = await self.query(language, stars)
+        if search is None:
+            return
+
+        count = search["repositoryCount"]
+        if count > MAX_RESULTS and (high is None or high > low):
+            # Open ranges are split at twice their lower bound, star counts thin out quickly. The first half always
+            # holds low, from 0 stars doubling alone would split off an empty range and repeat the same search
+            middle = max(low * 2 - 1, low) if high is None else (low + high) // 2
+            logger.info(f"Splitting Language:{language}, Range: {stars} ({count} repositories)")
+            await asyncio.gather(self.search_range(language, low, middle),
+                                 self.search_range(language, middle + 1, high))
+            return
+        if count > MAX_RESULTS:
+            logger.warning(f"Only {MAX_RESULTS} of {count} repositories with {stars} stars can be listed")
+
+        await self.deliver(search)
+        while search["pageInfo"]["hasNextPage"]:
+            search = await self.query(language, stars, search["pageInfo"]["endCursor"])
+            if search is None:
+                return
+            await self.deliver(search)
+
+    async def run(self, languages, min_stars, max_stars=None):
+        # Created here so they belong to the running event loop
+        self.semaphore = asyncio.Semaphore(self.concurrency)
+        self.budget = RateLimitBudget(self.reserve)
+        start = time.perf_counter()
+        await asyncio.gather(*(self.search_range(language, min_stars, max_stars) for language in languages))
+        elapsed = time.perf_counter() - start
+        logger.info(f"Discovered {len(self.seen)} repositories with {self.requests} requests "
+                    f"({self.failed} failed) in {elapsed:.0f}s")
+
+
+def discover(url, headers, languages, on_repos, min_stars=101, max_stars=None, concurrency=4):
+    """Find repositories of the given languages with at least min_stars stars, passing each page to on_repos."""
+    frontier = SearchFrontier(url, headers, on_repos, concurrency)
+    asyncio.run(frontier.run(languages, min_stars, max_stars))
+    return frontier
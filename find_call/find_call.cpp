@@ -6,8 +6,24 @@
 #include "clang/AST/AST.h"
 #include "clang/AST/Expr.h"
 #include "clang/Basic/SourceManager.h"
+#include "clang/Frontend/FrontendActions.h"
+#include "clang/Frontend/TextDiagnosticPrinter.h"
+#include "llvm/Support/FileSystem.h"
+#include "llvm/Support/Path.h"
+#include "llvm/Support/ThreadPool.h"
+#include "llvm/Support/VirtualFileSystem.h"
 #include <string>
+#include <memory>
+#include <vector>
+#include <algorithm>
+#include <map>
+#include <set>
+#include <mutex>
+#include <cstdio>
 #include <fstream>
+#include <sstream>
+#include <functional>
+#include <chrono>
 #include <iostream>
 #include <nlohmann/json.hpp>
 
@@ -15,10 +31,24 @@ using namespace clang;
 using namespace clang::ast_matchers;
 using json = nlohmann::json;
 
+// How calls are written: one full record per call, calls referencing a table of callee declarations, or
+// identical calls (callee, argument types and values) collapsed into one record with a count
+enum class Layout { Calls, Declarations, Collapsed };
+
 class FunctionCallPrinter : public MatchFinder::MatchCallback {
 
   int count = 0;
   json j;
+  // Name of the library whose headers this printer matches, empty for a single --header-regex run
+  std::string library;
+  // With --ndjson every call is serialised as one compact line as soon as it is matched
+  bool ndjson = false;
+  std::string lines;
+  Layout layout = Layout::Calls;
+  // Callee declarations by id ("<definition file>:<line>:<offset>#<hash>"), each recorded once
+  std::map<std::string, json> declarations;
+  // Collapsed calls by declaration id and arguments
+  std::map<std::string, json> collapsed;
 
   void handleCallExpr(const CallExpr *CE, const FunctionDecl *FD,
                                            const MatchFinder::MatchResult &Result) {
@@ -40,6 +70,10 @@ class FunctionCallPrinter : public MatchFinder::MatchCallback {
 
         handleFunctionProperties(FD, f);
 
+        if (!library.empty()) {
+          f["function"]["library"] = library;
+        }
+
         if (const clang::CXXMethodDecl *MD = llvm::dyn_cast<clang::CXXMethodDecl>(FD)) {
           f["function"]["isCXXMethodDecl"] = true;
           f["function"]["isVirtualCXXMethodDecl"] = MD->isVirtual();
@@ -54,12 +88,59 @@ class FunctionCallPrinter : public MatchFinder::MatchCallback {
           handleArg(i, arg, f);
         }
 
-        j.emplace_back(f);
+        if (layout != Layout::Calls) {
+          handleDeclarationCall(f, PL);
+        } else if (ndjson) {
+          lines += f.dump();
+          lines += '\n';
+        } else {
+          j.emplace_back(f);
+        }
         count++;
       }
     }
   }
 
+  void handleDeclarationCall(json &f, const PresumedLoc &PL) {
+    json d = f["function"];
+    d.erase("location");
+    d.erase("args");
+    // Macro generated functions and template instantiations share a definition location, so the id also
+    // carries a hash of the declaration's properties
+    std::stringstream hash;
+    hash << std::hex << std::hash<std::string>{}(d.dump());
+    std::string id = std::string(PL.getFilename()) + ":" + std::to_string(PL.getLine()) + ":" +
+                     std::to_string(PL.getColumn()) + "#" + hash.str();
+    if (declarations.find(id) == declarations.end()) {
+      d["id"] = id;
+      declarations.emplace(id, d);
+    }
+
+    json call;
+    call["decl"] = id;
+    call["args"] = f["function"]["args"];
+    if (layout == Layout::Collapsed) {
+      std::string key = id + call["args"].dump();
+      auto it = collapsed.find(key);
+      if (it == collapsed.end()) {
+        call["count"] = 1;
+        collapsed.emplace(key, call);
+      } else {
+        it->second["count"] = it->second["count"].get<int>() + 1;
+      }
+    } else {
+      call["location"] = f["function"]["location"];
+      if (ndjson) {
+        json line;
+        line["call"] = call;
+        lines += line.dump();
+        lines += '\n';
+      } else {
+        j.emplace_back(call);
+      }
+    }
+  }
+
   void handleArg(uint i, const Expr *arg, json &f) {
     f["function"]["args"][std::to_string(i)]["type"] = arg->getType().getAsString();
     if (const clang::IntegerLiteral *IL = llvm::dyn_cast<clang::IntegerLiteral>(arg)) {
@@ -106,6 +187,9 @@ class FunctionCallPrinter : public MatchFinder::MatchCallback {
   }
 
 public:
+  FunctionCallPrinter(std::string library, bool ndjson, Layout layout)
+      : library(std::move(library)), ndjson(ndjson), layout(layout) {}
+
   // Matcher callback handler
   void run(const MatchFinder::MatchResult &Result) override {
     if (const CallExpr *CE = Result.Nodes.getNodeAs<CallExpr>("callExpr")) {
@@ -121,47 +205,462 @@ public:
   json getJson() {
     return j;
   }
+
+  std::string takeLines() {
+    return std::move(lines);
+  }
+
+  std::map<std::string, json> takeDeclarations() {
+    return std::move(declarations);
+  }
+
+  std::map<std::string, json> takeCollapsed() {
+    return std::move(collapsed);
+  }
 };
 
 static llvm::cl::OptionCategory FindCallCategory("find-call options");
 static llvm::cl::opt <std::string> Header("header-regex",
                                          llvm::cl::desc("library header files/paths - 'json/json.h|etc'"),
                                          llvm::cl::cat(FindCallCategory));
+static llvm::cl::list <std::string> Libraries("library",
+                                             llvm::cl::desc("named library header files/paths - "
+                                                            "'jsoncpp=json/json.h|etc', may be repeated. "
+                                                            "Results are written to results/<name>/"),
+                                             llvm::cl::cat(FindCallCategory));
+static llvm::cl::opt <unsigned> Jobs("j",
+                                    llvm::cl::desc("number of translation units to parse in parallel"),
+                                    llvm::cl::init(1),
+                                    llvm::cl::cat(FindCallCategory));
+static llvm::cl::opt <bool> Ndjson("ndjson",
+                                  llvm::cl::desc("stream one compact json record per line to <client>.ndjson "
+                                                 "instead of writing one indented json document"),
+                                  llvm::cl::cat(FindCallCategory));
+static llvm::cl::opt <Layout> OutputLayout("layout",
+                                          llvm::cl::desc("layout of the result records"),
+                                          llvm::cl::values(
+                                              clEnumValN(Layout::Calls, "calls",
+                                                         "one full record per call (default)"),
+                                              clEnumValN(Layout::Declarations, "declarations",
+                                                         "callee declarations are written once and "
+                                                         "calls reference them by id"),
+                                              clEnumValN(Layout::Collapsed, "collapsed",
+                                                         "as declarations, identical calls are merged "
+                                                         "into one record with a count")),
+                                          llvm::cl::init(Layout::Calls),
+                                          llvm::cl::cat(FindCallCategory));
+static llvm::cl::opt <bool> UsePch("pch",
+                                  llvm::cl::desc("precompile the leading includes shared by the files of each "
+                                                 "compile flag group once and parse the files with -include-pch"),
+                                  llvm::cl::cat(FindCallCategory));
+
+// Library name and header regex of each printer, the name is empty for a single --header-regex run
+using LibrarySpec = std::pair<std::string, std::string>;
+
+// Calls found in one translation unit for each library, as json or NDJSON lines
+struct FileResult {
+  std::vector<json> Calls;
+  std::vector<std::string> Lines;
+  std::vector<std::map<std::string, json>> Declarations;
+  std::vector<std::map<std::string, json>> Collapsed;
+  // Errors blamed on the precompiled header the file was parsed with, and how long the parse took
+  size_t PchErrors = 0;
+  double Seconds = 0;
+};
+
+// Prints diagnostics as the tool does by default, counting the errors a precompiled header can cause: a stale or
+// incompatible PCH, a shared header without include guards included twice, or an include resolved differently
+class PchDiagnostics : public clang::TextDiagnosticPrinter {
+  size_t &PchErrors;
+
+public:
+  PchDiagnostics(size_t &PchErrors)
+      : TextDiagnosticPrinter(llvm::errs(), new DiagnosticOptions()), PchErrors(PchErrors) {}
+
+  void HandleDiagnostic(DiagnosticsEngine::Level Level, const Diagnostic &Info) override {
+    TextDiagnosticPrinter::HandleDiagnostic(Level, Info);
+    if (Level < DiagnosticsEngine::Error) {
+      return;
+    }
+    unsigned ID = Info.getID();
+    llvm::SmallString<128> Message;
+    Info.FormatDiagnostic(Message);
+    llvm::StringRef Text = Message.str();
+    if ((ID >= diag::DIAG_START_SERIALIZATION && ID < diag::DIAG_START_SERIALIZATION + diag::DIAG_SIZE_SERIALIZATION) ||
+        Text.contains("precompiled header") || Text.contains("redefinition") || Text.contains("file not found")) {
+      PchErrors++;
+    }
+  }
+};
+
+// Parse a single translation unit, returning the calls found for each library
+int scanFile(const clang::tooling::CompilationDatabase &Compilations, const std::string &Path,
+             const std::vector<LibrarySpec> &Specs, FileResult &Result, const std::string &Pch = "") {
+  std::vector<std::unique_ptr<FunctionCallPrinter>> Printers;
+  MatchFinder Finder;
+  for (const LibrarySpec &Spec : Specs) {
+    Printers.push_back(std::make_unique<FunctionCallPrinter>(Spec.first, Ndjson, OutputLayout));
+    Finder.addMatcher(traverse(TK_IgnoreUnlessSpelledInSource, callExpr(
+                                                                   allOf(isExpansionInMainFile(), callee(functionDecl(isExpansionInFileMatching(Spec.second))))).bind("callExpr")),
+                      Printers.back().get());
+  }
+
+  // Each TU gets its own file system so concurrent tools can use different working directories
+  llvm::IntrusiveRefCntPtr<llvm::vfs::FileSystem> FS = llvm::vfs::createPhysicalFileSystem();
+  clang::tooling::ClangTool Tool(Compilations, {Path}, std::make_shared<PCHContainerOperations>(), FS);
+  PchDiagnostics Diagnostics(Result.PchErrors);
+  if (!Pch.empty()) {
+    Tool.appendArgumentsAdjuster(clang::tooling::getInsertArgumentAdjuster(
+        {"-include-pch", Pch}, clang::tooling::ArgumentInsertPosition::BEGIN));
+    Tool.setDiagnosticConsumer(&Diagnostics);
+  }
+  auto Start = std::chrono::steady_clock::now();
+  int Status = Tool.run(clang::tooling::newFrontendActionFactory(&Finder).get());
+  Result.Seconds = std::chrono::duration<double>(std::chrono::steady_clock::now() - Start).count();
+
+  for (auto &Printer : Printers) {
+    Result.Calls.push_back(Printer->getJson());
+    Result.Lines.push_back(Printer->takeLines());
+    Result.Declarations.push_back(Printer->takeDeclarations());
+    Result.Collapsed.push_back(Printer->takeCollapsed());
+  }
+  return Status;
+}
 
-void writeJsonToFile(json j, std::string path) {
+// Files sharing a compile command (apart from the file itself), directory and leading includes, which are
+// precompiled once with --pch
+struct PchGroup {
+  std::string Directory;
+  std::string SourceDirectory;
+  std::string Language;
+  std::vector<std::string> Args;
+  std::vector<size_t> Files;
+  std::vector<std::string> Includes;
+  std::string Pch;
+  double BuildSeconds = 0;
+};
+
+// #include lines at the top of a source file, up to the first other directive or code
+std::vector<std::string> leadingIncludes(const std::string &Path) {
+  std::vector<std::string> Includes;
+  std::ifstream File(Path);
+  std::string Line;
+  bool InComment = false;
+  while (std::getline(File, Line)) {
+    llvm::StringRef Text = llvm::StringRef(Line).trim();
+    if (InComment) {
+      size_t End = Text.find("*/");
+      if (End == llvm::StringRef::npos) {
+        continue;
+      }
+      InComment = false;
+      Text = Text.substr(End + 2).trim();
+    }
+    if (Text.startswith("/*")) {
+      size_t End = Text.find("*/", 2);
+      if (End == llvm::StringRef::npos) {
+        InComment = true;
+        continue;
+      }
+      Text = Text.substr(End + 2).trim();
+    }
+    if (Text.empty() || Text.startswith("//")) {
+      continue;
+    }
+    llvm::StringRef Directive = Text.startswith("#") ? Text.drop_front().ltrim() : "";
+    if (!Directive.startswith("include") || Directive.startswith("include_next")) {
+      break;
+    }
+    Includes.push_back(Text.str());
+  }
+  return Includes;
+}
+
+// Group files by compile command, keeping only groups of several files with a common include prefix
+std::vector<PchGroup> planPchGroups(const clang::tooling::CompilationDatabase &Compilations,
+                                    const std::vector<std::string> &Paths) {
+  std::map<std::string, size_t> Index;
+  std::vector<PchGroup> Groups;
+  for (size_t i = 0; i < Paths.size(); i++) {
+    std::vector<clang::tooling::CompileCommand> Commands = Compilations.getCompileCommands(Paths[i]);
+    if (Commands.empty()) {
+      continue;
+    }
+    const clang::tooling::CompileCommand &Command = Commands.front();
+
+    PchGroup Group;
+    Group.Directory = Command.Directory;
+    Group.SourceDirectory = llvm::sys::path::parent_path(Paths[i]).str();
+    Group.Language = llvm::sys::path::extension(Paths[i]) == ".c" ? "c-header" : "c++-header";
+    // Drop the compiler, the file, its output and its language, which all differ for the precompiled header
+    for (size_t a = 1; a < Command.CommandLine.size(); a++) {
+      const std::string &Arg = Command.CommandLine[a];
+      if (Arg == "-o" || Arg == "-x") {
+        a++;
+        continue;
+      }
+      if (Arg == "-c" || Arg == Command.Filename || Arg == Paths[i]) {
+        continue;
+      }
+      Group.Args.push_back(Arg);
+    }
+
+    std::string Key = Group.Directory + "\n" + Group.SourceDirectory + "\n" + Group.Language;
+    for (const std::string &Arg : Group.Args) {
+      Key += "\n" + Arg;
+    }
+    auto It = Index.find(Key);
+    if (It == Index.end()) {
+      It = Index.emplace(Key, Groups.size()).first;
+      Groups.push_back(std::move(Group));
+    }
+    Groups[It->second].Files.push_back(i);
+  }
+
+  std::vector<PchGroup> Shared;
+  for (PchGroup &Group : Groups) {
+    if (Group.Files.size() < 2) {
+      continue;
+    }
+    Group.Includes = leadingIncludes(Paths[Group.Files[0]]);
+    for (size_t f = 1; f < Group.Files.size() && !Group.Includes.empty(); f++) {
+      std::vector<std::string> Includes = leadingIncludes(Paths[Group.Files[f]]);
+      size_t Common = 0;
+      while (Common < Includes.size() && Common < Group.Includes.size() && Includes[Common] == Group.Includes[Common]) {
+        Common++;
+      }
+      Group.Includes.resize(Common);
+    }
+    if (!Group.Includes.empty()) {
+      Shared.push_back(std::move(Group));
+    }
+  }
+  return Shared;
+}
+
+// Precompile the shared includes of a group into Dir, leaving Group.Pch empty on failure
+void buildPch(PchGroup &Group, const std::string &Dir, size_t Id) {
+  std::string Header = Dir + "/group" + std::to_string(Id) + ".h";
+  {
+    std::ofstream File(Header);
+    for (const std::string &Include : Group.Includes) {
+      File << Include << "\n";
+    }
+  }
+
+  // Quoted includes are resolved from the header's directory first, point them back at the sources
+  std::vector<std::string> Args = Group.Args;
+  Args.push_back("-iquote");
+  Args.push_back(Group.SourceDirectory);
+  clang::tooling::FixedCompilationDatabase Compilations(Group.Directory, Args);
+
+  std::string Pch = Header + ".pch";
+  llvm::IntrusiveRefCntPtr<llvm::vfs::FileSystem> FS = llvm::vfs::createPhysicalFileSystem();
+  clang::tooling::ClangTool Tool(Compilations, {Header}, std::make_shared<PCHContainerOperations>(), FS);
+  Tool.clearArgumentsAdjusters();
+  Tool.appendArgumentsAdjuster(clang::tooling::getClangStripOutputAdjuster());
+  Tool.appendArgumentsAdjuster(clang::tooling::getClangStripDependencyFileAdjuster());
+  Tool.appendArgumentsAdjuster(clang::tooling::getInsertArgumentAdjuster(
+      {"-x", Group.Language}, clang::tooling::ArgumentInsertPosition::BEGIN));
+  Tool.appendArgumentsAdjuster(clang::tooling::getInsertArgumentAdjuster(
+      {"-o", Pch}, clang::tooling::ArgumentInsertPosition::END));
+
+  auto Start = std::chrono::steady_clock::now();
+  int Status = Tool.run(clang::tooling::newFrontendActionFactory<clang::GeneratePCHAction>().get());
+  Group.BuildSeconds = std::chrono::duration<double>(std::chrono::steady_clock::now() - Start).count();
+  if (Status == 0 && llvm::sys::fs::exists(Pch)) {
+    Group.Pch = Pch;
+  }
+}
+
+// results/[<subdir>/]<client><extension>, the client is the path component containing '@@'
+std::string resultPath(std::string path, std::string subdir, std::string extension) {
+  std::string delimiter = "/";
+  std::string target = "@@";
+  std::stringstream ss(path);
+  std::string token;
+  while (std::getline(ss, token, delimiter[0])) {
+    if (token.find(target) != std::string::npos) {
+      std::string dir = "results/" + subdir;
+      if (!subdir.empty()) {
+        llvm::sys::fs::create_directories(dir);
+        dir += "/";
+      }
+      return dir + token + extension;
+    }
+  }
+  return "";
+}
+
+void writeStringToFile(const std::string &content, const std::string &result) {
+  if (result.empty()) {
+    return;
+  }
+  // open a file stream
+  std::ofstream file(result);
+  // check if the file stream has been successfully opened
+  if (!file) {
+    std::cerr << "Failed to open the file." << std::endl;
+  }
+
+  // write JSON string to the file
+  file << content;
+
+  // check if there were any problems writing to the file
+  if (!file) {
+    std::cerr << "Failed to write to the file." << std::endl;
+  }
+
+  // close the file stream
+  file.close();
+}
+
+void writeJsonToFile(json j, std::string path, std::string subdir = "") {
   std::string json_str = j.dump(4);
 
   // check if JSON string is "null" or "{}"
   if (json_str != "null") {
-    // open a file stream
-    std::string delimiter = "/";
-    std::string target = "@@";
-    std::stringstream ss(path);
-    std::string token;
-    while (std::getline(ss, token, delimiter[0])) {
-      if (token.find(target) != std::string::npos) {
-        std::ofstream file("results/" + token + ".json");
-        // check if the file stream has been successfully opened
-        if (!file) {
+    writeStringToFile(json_str, resultPath(path, subdir, ".json"));
+  } else {
+    std::cout << "No calls found. \n";
+  }
+}
+
+// Write a declaration table and the calls referencing it, as {"declarations": [...], "calls": [...]} or as
+// NDJSON {"declaration": {...}} lines followed by {"call": {...}} lines
+void writeDeclarationsToFile(const std::map<std::string, json> &declarations, const json &calls, std::string path,
+                             std::string subdir = "") {
+  if (calls.empty()) {
+    std::cout << "No calls found. \n";
+    return;
+  }
+
+  if (Ndjson) {
+    std::string lines;
+    for (const auto &Declaration : declarations) {
+      json line;
+      line["declaration"] = Declaration.second;
+      lines += line.dump() + "\n";
+    }
+    for (const json &call : calls) {
+      json line;
+      line["call"] = call;
+      lines += line.dump() + "\n";
+    }
+    writeStringToFile(lines, resultPath(path, subdir, ".ndjson"));
+  } else {
+    json j;
+    j["declarations"] = json::array();
+    for (const auto &Declaration : declarations) {
+      j["declarations"].emplace_back(Declaration.second);
+    }
+    j["calls"] = calls;
+    writeStringToFile(j.dump(4), resultPath(path, subdir, ".json"));
+  }
+}
+
+// Appends the NDJSON lines of each TU to the per library result files as soon as every earlier TU is written,
+// so only unfinished TUs are held in memory and the file order matches the command line for any -j
+class NdjsonWriter {
+  std::mutex lock;
+  std::vector<std::string> paths;
+  std::vector<std::ofstream> files;
+  std::vector<size_t> counts;
+  std::vector<std::unique_ptr<FileResult>> pending;
+  // Declarations already written to each file, a declaration precedes the first call referencing it
+  std::vector<std::set<std::string>> written;
+  size_t next = 0;
+
+public:
+  NdjsonWriter(const std::string &path, const std::vector<LibrarySpec> &Specs, size_t numFiles)
+      : counts(Specs.size(), 0), pending(numFiles), written(Specs.size()) {
+    for (const LibrarySpec &Spec : Specs) {
+      paths.push_back(resultPath(path, Spec.first, ".ndjson"));
+      files.emplace_back();
+      if (!paths.back().empty()) {
+        files.back().open(paths.back());
+        if (!files.back()) {
           std::cerr << "Failed to open the file." << std::endl;
         }
+      }
+    }
+  }
 
-        // write JSON string to the file
-        file << json_str;
+  void complete(size_t i, std::unique_ptr<FileResult> Result) {
+    std::lock_guard<std::mutex> Guard(lock);
+    pending[i] = std::move(Result);
+    while (next < pending.size() && pending[next]) {
+      for (size_t l = 0; l < files.size(); l++) {
+        for (const auto &Declaration : pending[next]->Declarations[l]) {
+          if (written[l].insert(Declaration.first).second) {
+            json line;
+            line["declaration"] = Declaration.second;
+            files[l] << line.dump() << '\n';
+          }
+        }
+        const std::string &Lines = pending[next]->Lines[l];
+        if (!Lines.empty()) {
+          files[l] << Lines;
+          counts[l]++;
+        }
+      }
+      pending[next].reset();
+      next++;
+    }
+  }
 
-        // check if there were any problems writing to the file
-        if (!file) {
-          std::cerr << "Failed to write to the file." << std::endl;
+  void close() {
+    for (size_t l = 0; l < files.size(); l++) {
+      files[l].close();
+      if (!files[l] && !paths[l].empty()) {
+        std::cerr << "Failed to write to the file." << std::endl;
+      }
+      // Like the json output, clients without calls get no result file
+      if (counts[l] == 0) {
+        if (!paths[l].empty()) {
+          std::remove(paths[l].c_str());
         }
+        std::cout << "No calls found. \n";
+      }
+    }
+  }
+};
+
+// What became of a file of a group with a precompiled header
+enum PchOutcome : char { PchNone, PchUsed, PchReparsed, PchCompileFailed };
 
-        // close the file stream
-        file.close();
-        break;
+// The parse time of each file is measured, how long it would have taken without the precompiled header is not. The
+// time saved is therefore an upper bound, assuming every file would have spent as long parsing the shared includes as
+// building their precompiled header took
+void reportPch(const std::vector<PchGroup> &Groups, const std::vector<char> &Outcomes,
+               const std::vector<double> &Seconds) {
+  size_t Built = 0, Used = 0, Reparsed = 0, CompileFailed = 0;
+  double BuildSeconds = 0, UsedSeconds = 0, ReparsedSeconds = 0, MaxSavedSeconds = 0;
+  for (const PchGroup &Group : Groups) {
+    BuildSeconds += Group.BuildSeconds;
+    if (Group.Pch.empty()) {
+      continue;
+    }
+    Built++;
+    for (size_t i : Group.Files) {
+      if (Outcomes[i] == PchUsed) {
+        Used++;
+        UsedSeconds += Seconds[i];
+        MaxSavedSeconds += Group.BuildSeconds;
+      } else if (Outcomes[i] == PchReparsed) {
+        Reparsed++;
+        ReparsedSeconds += Seconds[i];
+      } else if (Outcomes[i] == PchCompileFailed) {
+        CompileFailed++;
       }
     }
-  } else {
-    std::cout << "No calls found. \n";
   }
+  MaxSavedSeconds = std::max(0.0, MaxSavedSeconds - BuildSeconds);
+  llvm::outs() << "PCH: built " << Built << " of " << Groups.size() << " headers in " << BuildSeconds << "s, used by "
+               << Used << " files parsed in " << UsedSeconds << "s, " << Reparsed << " reparsed without it after a PCH "
+               << "error in " << ReparsedSeconds << "s, " << CompileFailed << " failed to compile with it, "
+               << "time saved at most " << MaxSavedSeconds << "s (assuming each file reparses the shared includes for "
+               << "as long as building the PCH took)\n";
 }
 
 int main(int argc, const char **argv) {
@@ -180,19 +679,130 @@ int main(int argc, const char **argv) {
 
   clang::tooling::CommonOptionsParser &OptionsParser = ExpectedParser.get();
   auto paths = OptionsParser.getSourcePathList();
-  clang::tooling::ClangTool Tool(OptionsParser.getCompilations(), paths);
 
-  FunctionCallPrinter Printer;
+  // One printer per library so each TU is parsed once for every library of interest
+  std::vector<LibrarySpec> Specs;
+  for (const std::string &Library : Libraries) {
+    size_t Split = Library.find('=');
+    if (Split == std::string::npos || Split == 0) {
+      llvm::errs() << "Invalid --library '" << Library << "', expected name=regex\n";
+      return 1;
+    }
+    Specs.emplace_back(Library.substr(0, Split), Library.substr(Split + 1));
+  }
+  if (Specs.empty()) {
+    Specs.emplace_back("", Header);
+  }
 
-  MatchFinder Finder;
-  Finder.addMatcher(traverse(TK_IgnoreUnlessSpelledInSource, callExpr(
-                                                                 allOf(isExpansionInMainFile(), callee(functionDecl(isExpansionInFileMatching(Header))))).bind("callExpr")),
-                    &Printer);
+  // Results are collected per TU and merged in command line order, so the output does not depend on -j
+  std::vector<std::unique_ptr<FileResult>> FileResults(paths.size());
+  std::unique_ptr<NdjsonWriter> Writer;
+  // Collapsed counts are only final once every TU is parsed, so they are never streamed
+  if (Ndjson && OutputLayout != Layout::Collapsed) {
+    Writer = std::make_unique<NdjsonWriter>(paths[0], Specs, paths.size());
+  }
+  std::vector<int> Statuses(paths.size(), 0);
 
-  auto tool = Tool.run(clang::tooling::newFrontendActionFactory(&Finder).get());
+  // Precompiled header of each file, empty when it is parsed from scratch
+  std::vector<std::string> FilePch(paths.size());
+  std::vector<PchGroup> Groups;
+  llvm::SmallString<128> PchDir;
+  if (UsePch && !llvm::sys::fs::createUniqueDirectory("find-call-pch", PchDir)) {
+    Groups = planPchGroups(OptionsParser.getCompilations(), paths);
+    llvm::ThreadPool Pool(llvm::hardware_concurrency(std::max(1u, (unsigned) Jobs)));
+    for (size_t g = 0; g < Groups.size(); g++) {
+      Pool.async([&, g]() {
+        buildPch(Groups[g], PchDir.str().str(), g);
+      });
+    }
+    Pool.wait();
+    for (const PchGroup &Group : Groups) {
+      for (size_t i : Group.Files) {
+        FilePch[i] = Group.Pch;
+      }
+    }
+  }
+  // Written by the worker of each file, a byte each so neighbouring files never share a word
+  std::vector<char> Outcomes(paths.size(), PchNone);
+  std::vector<double> Seconds(paths.size(), 0);
+
+  {
+    llvm::ThreadPool Pool(llvm::hardware_concurrency(std::max(1u, (unsigned) Jobs)));
+    for (size_t i = 0; i < paths.size(); i++) {
+      Pool.async([&, i]() {
+        auto Result = std::make_unique<FileResult>();
+        Statuses[i] = scanFile(OptionsParser.getCompilations(), paths[i], Specs, *Result, FilePch[i]);
+        if (!FilePch[i].empty()) {
+          Outcomes[i] = Statuses[i] == 0 ? PchUsed : Result->PchErrors ? PchReparsed : PchCompileFailed;
+        }
+        // A file that does not compile anyway is not parsed twice
+        if (Outcomes[i] == PchReparsed) {
+          Result = std::make_unique<FileResult>();
+          Statuses[i] = scanFile(OptionsParser.getCompilations(), paths[i], Specs, *Result);
+        }
+        Seconds[i] = Result->Seconds;
+        if (Writer) {
+          Writer->complete(i, std::move(Result));
+        } else {
+          FileResults[i] = std::move(Result);
+        }
+      });
+    }
+    Pool.wait();
+  }
+
+  int tool = 0;
+  for (int Status : Statuses) {
+    tool = std::max(tool, Status);
+  }
+
+  if (!PchDir.empty()) {
+    reportPch(Groups, Outcomes, Seconds);
+    llvm::sys::fs::remove_directories(PchDir);
+  }
+
+  if (Writer) {
+    Writer->close();
+    return tool;
+  }
+
+  if (OutputLayout != Layout::Calls) {
+    for (size_t l = 0; l < Specs.size(); l++) {
+      std::map<std::string, json> Declarations;
+      std::map<std::string, json> Collapsed;
+      json Calls = json::array();
+      for (const auto &Result : FileResults) {
+        Declarations.insert(Result->Declarations[l].begin(), Result->Declarations[l].end());
+        for (const auto &Call : Result->Collapsed[l]) {
+          auto it = Collapsed.find(Call.first);
+          if (it == Collapsed.end()) {
+            Collapsed.emplace(Call.first, Call.second);
+          } else {
+            it->second["count"] = it->second["count"].get<int>() + Call.second["count"].get<int>();
+          }
+        }
+        for (const json &Call : Result->Calls[l]) {
+          Calls.emplace_back(Call);
+        }
+      }
+      for (const auto &Call : Collapsed) {
+        Calls.emplace_back(Call.second);
+      }
+      writeDeclarationsToFile(Declarations, Calls, paths[0], Specs[l].first);
+    }
+    return tool;
+  }
 
   // dump JSON object to string
-  writeJsonToFile(Printer.getJson(), paths[0]);
+  for (size_t l = 0; l < Specs.size(); l++) {
+    json j;
+    for (const auto &Result : FileResults) {
+      for (const json &f : Result->Calls[l]) {
+        j.emplace_back(f);
+      }
+    }
+    writeJsonToFile(j, paths[0], Specs[l].first);
+  }
 
   return tool;
-}
\ No newline at end of file
+}
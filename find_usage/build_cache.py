@@ -0,0 +1,119 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+from pathlib import Path
+
+# Files produced by CMake configure (configure_file etc.) that translation units may include
+GENERATED_EXTENSIONS = ('.h', '.hh', '.hpp', '.hxx', '.inc', '.ipp', '.def')
+
+
+class BuildCache:
+    """Configure results of client repositories, keyed by repository, commit SHA and checkout.
+
+    Each entry records the configure outcome and, when configure succeeded, the compile_commands.json
+    and the headers generated into the build directory, so re-analysing the same commit skips CMake.
+    The checkout is None for a full clone with every submodule, a sparse checkout may lack files or
+    submodules CMake needs so its results are kept apart. A failed configure is only reused for
+    failure_ttl seconds, forever when None.
+    """
+
+    def __init__(self, root, failure_ttl=None):
+        self.root = Path(root)
+        self.failure_ttl = failure_ttl
+
+    def entry_dir(self, repo, sha, checkout=None):
+        if checkout is None:
+            return self.root / repo / sha
+        return self.root / repo / f"{sha}-{hashlib.sha1(checkout.encode()).hexdigest()[:12]}"
+
+    def load(self, repo, sha, checkout=None):
+        path = self.entry_dir(repo, sha, checkout) / 'entry.json'
+        try:
+            with open(path, 'r') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if entry['outcome'] == 'cmake_failed' and self.failure_ttl is not None:
+            # Entries cached before the time was recorded
+            stored_at = entry.get('stored_at') or os.path.getmtime(path)
+            if time.time() - stored_at >= self.failure_ttl:
+                return None
+        return entry
+
+    def store(self, repo, sha, repo_path, outcome, commands_path=None, reason=None, checkout=None):
+        entry_dir = self.entry_dir(repo, sha, checkout)
+        tmp_dir = entry_dir.with_name(entry_dir.name + '.tmp')
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        tmp_dir.mkdir(parents=True)
+
+        entry = {'outcome': outcome, 'reason': reason, 'repo_root': str(repo_path), 'commands': None,
+                 'checkout': checkout, 'stored_at': time.time()}
+        if commands_path is not None:
+            entry['commands'] = str(commands_path.relative_to(repo_path))
+            shutil.copyfile(commands_path, tmp_dir / 'compile_commands.json')
+            entry['tus'] = self.count_commands(tmp_dir / 'compile_commands.json')
+            self.store_generated(repo_path, tmp_dir / 'generated')
+
+        with open(tmp_dir / 'entry.json', 'w') as f:
+            json.dump(entry, f)
+        # Replace any previous entry in one step so readers never see a partial one
+        shutil.rmtree(entry_dir, ignore_errors=True)
+        os.replace(tmp_dir, entry_dir)
+
+    @staticmethod
+    def count_commands(commands_path):
+        try:
+            with open(commands_path, 'r') as f:
+                return len(json.load(f))
+        except (OSError, ValueError):
+            return None
+
+    def translation_units(self, repo):
+        """Number of compile commands of the most recently configured commit of repo, None when unknown."""
+        entries = list((self.root / repo).glob('*/entry.json'))
+        if not entries:
+            return None
+        newest = max(entries, key=lambda path: path.stat().st_mtime)
+        try:
+            with open(newest, 'r') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if entry.get('commands') is None:
+            return None
+        # Entries cached before the count was recorded
+        return entry.get('tus') or self.count_commands(newest.parent / 'compile_commands.json')
+
+    def store_generated(self, repo_path, dest):
+        for build_dir in (repo_path / 'build', repo_path / 'src' / 'build'):
+            if not build_dir.is_dir():
+                continue
+            for root, dirs, files in os.walk(build_dir):
+                dirs[:] = [d for d in dirs if d != 'CMakeFiles']
+                for f in files:
+                    if f.endswith(GENERATED_EXTENSIONS):
+                        src = Path(root) / f
+                        target = dest / src.relative_to(repo_path)
+                        target.parent.mkdir(parents=True, exist_ok=True)
+                        shutil.copyfile(src, target)
+
+    def restore(self, repo, sha, repo_path, checkout=None):
+        """Restore a cached configure result into a fresh checkout, returning the entry or None on a miss."""
+        entry = self.load(repo, sha, checkout)
+        if entry is None or entry['commands'] is None:
+            return entry
+
+        entry_dir = self.entry_dir(repo, sha, checkout)
+        # compile_commands.json holds absolute paths, point them at the current checkout
+        commands = (entry_dir / 'compile_commands.json').read_text()
+        commands = commands.replace(entry['repo_root'], str(repo_path))
+        target = repo_path / entry['commands']
+        target.parent.mkdir(parents=True, exist_ok=True)
+        target.write_text(commands)
+
+        generated = entry_dir / 'generated'
+        if generated.is_dir():
+            shutil.copytree(generated, repo_path, dirs_exist_ok=True)
+        return entry
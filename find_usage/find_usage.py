@@ -1,48 +1,126 @@
 import json
-import pathlib
-import sys
 import os
-from git import Repo
+import time
+import shutil
+import argparse
+import threading
+import statistics
+from concurrent.futures import ThreadPoolExecutor
+from git import GitCommandError, Repo
+import sys
 import subprocess
+import tempfile
 import logging
 from pathlib import Path
 
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from build_cache import BuildCache
+from include_scan import filter_entries
+from run_journal import RunJournal
+from sparse_clone import checkout_submodules, sparse_clone
+from stage_limits import CPU_LIMIT_EXIT, CommandTimeout, StageLimits
+from stage_metrics import StageMetrics, checkout_bytes, count_calls, previous_costs, wait_with_rusage
+from common.clone_cache import CloneCache
+from common.dependency_index import CLIENT_EXTRACTORS, open_index
+
 # Create a custom logger
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
 # Create handlers
-f_handler = logging.FileHandler('file.log', mode='w')
+f_handler = logging.FileHandler('file.log', mode='a')
 f_handler.setLevel(logging.INFO)
 
 # Create formatters and add it to handlers
 f_format = logging.Formatter('%(asctime)s:%(levelname)s:%(name)s:%(message)s')
 f_handler.setFormatter(f_format)
 
-# Add handlers to the logger
+# Add handlers to the logger, and to the loggers of the modules used
 logger.addHandler(f_handler)
+for module in ('sparse_clone', 'common.clone_cache'):
+    logging.getLogger(module).setLevel(logging.INFO)
+    logging.getLogger(module).addHandler(f_handler)
 
 
 
 class Config:
     EXCLUDE_PATHS = []
-    LIBRARY_NAME = ''
+    # Library name (as used in the dependency dataset) -> header regex, scanned together in a single pass
+    LIBRARIES = {}
     IGNORE_LIST = []
-    HEADER_PATTERN = ''
     TOOL_PATH = ''
     WORKING_DIR = Path(os.getcwd())
+    # Concurrency of each pipeline stage
+    DOWNLOAD_WORKERS = 4
+    CONFIGURE_WORKERS = 2
+    TOOL_WORKERS = 2
+    # Translation units each find-call run parses in parallel (find-call -j)
+    TOOL_JOBS = max(1, (os.cpu_count() or 1) // TOOL_WORKERS)
+    CLEANUP_WORKERS = 2
+    # Have find-call stream compact NDJSON results instead of one indented json document
+    NDJSON = False
+    # find-call --layout: calls, declarations (callee declaration table) or collapsed (call counts)
+    LAYOUT = 'calls'
+    # Only pass find-call the TUs whose include directives can reach a library header
+    PREFILTER = True
+    # Have find-call precompile the includes shared by each compile flag group (find-call --pch)
+    PCH = False
+    # Back-pressure: number of client checkouts allowed on disk at once and free space to keep
+    MAX_CHECKOUTS = 8
+    MIN_FREE_DISK = 10 * 1024 ** 3
+    # Outcome of every processed repository, used to resume interrupted runs
+    JOURNAL_PATH = WORKING_DIR / 'find_usage.sqlite'
+    # Remote hosting client repositories, a local directory of <owner>/<name>.git bare repos also works
+    GIT_BASE_URL = 'https://github.com'
+    # Optional shared cache of bare mirrors clients are checked out from
+    CLONE_CACHE = None
+    # Blobless clones checking out only build files and sources, with only the submodules the build needs
+    SPARSE_CLONE = False
+    # Configure outcomes and compile_commands.json per repository commit, failed configures are retried after a day
+    BUILD_CACHE = None
+    CMAKE_FAILURE_TTL = 24 * 3600
+    # Wall time, CPU time and peak RSS of every stage of every repository, written as JSONL when given a path
+    METRICS = StageMetrics()
+    # Time budget of the download, configure and find-call stages of a repository, and ulimits of the commands they run
+    DOWNLOAD_TIMEOUT = 30 * 60
+    CONFIGURE_TIMEOUT = 30 * 60
+    TOOL_TIMEOUT = 2 * 3600
+    LIMITS = StageLimits({'download': DOWNLOAD_TIMEOUT, 'configure': CONFIGURE_TIMEOUT, 'tool': TOOL_TIMEOUT})
+    # Command output logged to file.log, the rest is dropped
+    MAX_LOGGED_OUTPUT = 64 * 1024
+
+
+def output_tail(f):
+    f.seek(0, os.SEEK_END)
+    size = f.tell()
+    f.seek(max(0, size - Config.MAX_LOGGED_OUTPUT))
+    return f.read().decode(errors='replace')
 
 
 def run_command(command, directory=Config.WORKING_DIR):
+    """Run a shell command within the time left to the current stage, raising CommandTimeout when it runs out."""
     try:
-        result = subprocess.run(command, capture_output=True, text=True, shell=True, cwd=directory)
-        logger.info(result.stdout)
-
-        if result.returncode != 0:
-            logger.error(f'Error: {result.stderr}')
-            return False
+        timeout = Config.LIMITS.remaining()
+        # Output goes through files so the child can be reaped with wait4, which reports its resource usage
+        with tempfile.TemporaryFile() as stdout, tempfile.TemporaryFile() as stderr:
+            # A process group of its own, so a timeout kills everything the command started
+            process = subprocess.Popen(Config.LIMITS.wrap(command), stdout=stdout, stderr=stderr, shell=True,
+                                       cwd=directory, start_new_session=True)
+            with Config.LIMITS.watchdog(process, timeout) as expired:
+                returncode, rusage = wait_with_rusage(process)
+            Config.METRICS.add_rusage(rusage)
+            logger.info(output_tail(stdout))
+
+            if expired.is_set() or returncode in CPU_LIMIT_EXIT:
+                reason = f"after {timeout:.0f}s" if expired.is_set() else "on its CPU time limit"
+                raise CommandTimeout(f"'{command.split()[0]}' in {directory} was killed {reason}")
+            if returncode != 0:
+                logger.error(f'Error: {output_tail(stderr)}')
+                return False
 
         return True
+    except CommandTimeout:
+        raise
     except Exception as e:
         logger.error(f"Error: {e}")
         return False
@@ -53,7 +131,7 @@ def is_not_excluded_path(file_path):
     return not any(path in file_path for path in Config.EXCLUDE_PATHS)
 
 
-def parse_compile_commands(repo_path):
+def find_compile_commands(repo_path):
     # Locate compile_commands
     commands_path = repo_path / 'compile_commands.json'
     if not commands_path.exists():
@@ -62,22 +140,33 @@ def parse_compile_commands(repo_path):
         commands_path = repo_path / 'src' / 'compile_commands.json'
     if not commands_path.exists():
         commands_path = repo_path / 'src' / 'build' / 'compile_commands.json'
+    return commands_path if commands_path.exists() else None
+
+
+def parse_compile_commands(repo_path, libraries):
+    commands_path = find_compile_commands(repo_path)
 
-    if commands_path.exists():
+    if commands_path is not None:
         with commands_path.open() as f:
             data = json.load(f)
 
-        file_list = [
-            item["file"]
+        entries = [
+            item
             for item in data
             if os.path.exists(item["file"]) and (
                     item["file"].endswith('.c') or item["file"].endswith('.cc') or item["file"].endswith('.cpp'))
                and len(item["file"].rsplit('.', 2)) < 3 and is_not_excluded_path(
-                item["file"]) and Config.LIBRARY_NAME in item["command"].lower()
+                item["file"]) and any(library in item["command"].lower() for library in libraries)
         ]
-        return file_list
+        if not entries:
+            return None
+        if Config.PREFILTER:
+            included = filter_entries(entries, [Config.LIBRARIES[library] for library in libraries])
+            logger.info(f"Include scan skipped {len(entries) - len(included)} of {len(entries)} files in {repo_path}")
+            entries = included
+        return [item["file"] for item in entries]
 
-    return []
+    return None
 
 
 def generate_compile_commands(repo_path):
@@ -113,166 +202,441 @@ def generate_compile_commands(repo_path):
     return None
 
 
-def run_clang_tool(repo_path, cmake_failed, ran_on_tool):
-    files = parse_compile_commands(repo_path)
-    if not files:
+def configure_repository(repo, repo_path, checkout=None):
+    """Produce compile_commands.json for a checkout, reusing the build cache for an already configured commit.
+
+    checkout describes how the repository was checked out, as returned by download_repo.
+    Returns 'configured', 'non_cmake' or 'cmake_failed'.
+    """
+    sha = None
+    if Config.BUILD_CACHE is not None:
+        try:
+            sha = Repo(repo_path).head.commit.hexsha
+        except (ValueError, GitCommandError) as e:
+            # An empty repository has no commit to key the cache on, configure it without caching
+            logger.info(f"Not caching the configure outcome of {repo}, no commit checked out: {e}")
+    if sha is not None:
+        entry = Config.BUILD_CACHE.restore(repo, sha, repo_path, checkout)
+        if entry is not None:
+            logger.info(f"Reusing cached configure outcome '{entry['outcome']}' for {repo}@{sha}")
+            return entry['outcome']
+
+    logger.info(f"Attempting to run CMake: {repo}")
+    commands_path = None
+    reason = None
+    if not generate_compile_commands(repo_path):
+        outcome = "non_cmake"
+        reason = "no CMakeLists.txt or compile_commands.json found"
+    else:
+        commands_path = find_compile_commands(repo_path)
+        outcome = "configured" if commands_path is not None else "cmake_failed"
+        if commands_path is None:
+            reason = "CMake did not produce compile_commands.json"
+
+    if sha is not None:
+        Config.BUILD_CACHE.store(repo, sha, repo_path, outcome, commands_path, reason, checkout)
+    return outcome
+
+
+def run_clang_tool(repo_path, libraries):
+    """Run find-call on the files that may use the libraries.
+
+    Returns 'ran_on_tool', 'cmake_failed' when there is no compile_commands.json or 'tool_failed' when find-call
+    exits with an error.
+    """
+    files = parse_compile_commands(repo_path, libraries)
+    if files is None:
         logger.error("Failed to locate compile_commands.json")
-        cmake_failed.append(pathlib.PurePath(repo_path))
-        return False, cmake_failed, ran_on_tool
-    ran_on_tool.append(pathlib.PurePath(repo_path))
-    logger.info("\nrunning tool on repo!\n")
+        return "cmake_failed"
+    Config.METRICS.annotate(tus=len(files))
+    if not files:
+        # Every file was skipped by the include scan, the repository has no usage to record
+        logger.info(f"No files in {repo_path} include the library headers")
+        return "ran_on_tool"
+    logger.info(f"\nrunning tool on repo: {repo_path}\n")
+    # Every library is matched in the same pass, results are written to results/<library>/
+    library_args = " ".join(f'--library="{library}={Config.LIBRARIES[library]}"' for library in libraries)
     if not run_command("bin/find-call " + " ".join(
-            files) + " " + "--extra-arg=-Wno-everything" + " " + f'--header-regex="{Config.HEADER_PATTERN}"',
+            files) + " " + "--extra-arg=-Wno-everything" + " " + f"-j {Config.TOOL_JOBS} " + ("--ndjson " if Config.NDJSON else "") + f"--layout={Config.LAYOUT} " + ("--pch " if Config.PCH else "") + library_args,
                        Config.TOOL_PATH):
-        return True, cmake_failed, ran_on_tool
-    return True, cmake_failed, ran_on_tool
-
+        logger.error(f"find-call exited with an error for: {repo_path}")
+        return "tool_failed"
+    return "ran_on_tool"
+
+
+class PipelineStages:
+    """Bounded concurrency for each stage of processing a client repository."""
+
+    def __init__(self):
+        self.download = threading.BoundedSemaphore(Config.DOWNLOAD_WORKERS)
+        self.configure = threading.BoundedSemaphore(Config.CONFIGURE_WORKERS)
+        self.tool = threading.BoundedSemaphore(Config.TOOL_WORKERS)
+        self.cleanup = threading.BoundedSemaphore(Config.CLEANUP_WORKERS)
+        self.in_flight = 0
+        self.lock = threading.Lock()
+
+    def wait_for_disk_space(self):
+        # Hold back new downloads while disk is low, unless nothing else is on disk to be cleaned up
+        while shutil.disk_usage(Config.WORKING_DIR).free < Config.MIN_FREE_DISK:
+            with self.lock:
+                if self.in_flight == 0:
+                    logger.warning("Low disk space with no checkouts in flight, continuing")
+                    return
+            time.sleep(5)
+
+    def start_checkout(self):
+        self.wait_for_disk_space()
+        with self.lock:
+            self.in_flight += 1
+
+    def end_checkout(self):
+        with self.lock:
+            self.in_flight -= 1
+
+
+def cleanup_repo(repo, stages):
+    with stages.cleanup, Config.METRICS.stage(repo, 'cleanup') as metrics:
+        if not run_command(f"rm -fr {repo}"):
+            metrics['outcome'] = 'failed'
+            logger.error(f"failed to remove repo:{repo}")
 
-def process_repositories(repos):
-    failed = []
-    non_cmake = []
-    cmake_failed = []
-    ran_on_tool = []
 
-    dir_path = Config.WORKING_DIR
+def result_path(repo, library):
+    # find-call names its output after the path component containing '@@', the newer one when both formats exist
+    paths = [Path(Config.TOOL_PATH) / 'results' / library / f"{repo}{extension}" for extension in ('.ndjson', '.json')]
+    paths = [path for path in paths if path.exists()]
+    return str(max(paths, key=lambda path: path.stat().st_mtime)) if paths else None
 
-    logger.info(f"Scanning Repositories in: {dir_path}")
-    for repo in repos:
-        repo_path = dir_path / repo
-        if repo in Config.IGNORE_LIST:
-            continue
 
+def process_repository(repo, libraries, stages, journal):
+    start = time.perf_counter()
+    try:
+        outcome = process_repository_stages(repo, libraries, stages, journal)
+    except Exception:
+        # One broken client must not end the run, it is recorded as failed and retried next time
+        logger.exception(f"Unexpected error processing repository: {repo}")
+        outcome = "failed"
+    duration = time.perf_counter() - start
+    for library in libraries:
+        # find-call writes what it found before failing, the partial result is kept until a retry replaces it
+        journal.record(library, repo, outcome,
+                       result_path(repo, library) if outcome in ("ran_on_tool", "tool_failed") else None, duration)
+    return outcome
+
+
+def process_repository_stages(repo, libraries, stages, journal):
+    repo_path = Config.WORKING_DIR / repo
+
+    stages.start_checkout()
+    try:
         logger.info(f"Downloading repository: {repo}")
+        with stages.download, Config.METRICS.stage(repo, 'download') as metrics, Config.LIMITS.stage('download'):
+            try:
+                checkout = download_repo(repo, libraries)
+            except CommandTimeout as e:
+                metrics['outcome'] = 'timed_out'
+                logger.error(f"Download timed out: {repo}: {e}")
+                return "timed_out"
+            except Exception as e:
+                metrics['outcome'] = 'failed'
+                logger.error(f"Error downloading repository: {e}")
+                return "failed"
+            metrics['disk_bytes'], metrics['bytes_cloned'] = checkout_bytes(repo_path)
+            logger.info(f"Downloaded {repo} ({metrics['disk_bytes'] / 1024 ** 2:.1f}MB on disk)")
+        for library in libraries:
+            journal.record(library, repo, "downloaded")
 
-        try:
-            download_repo(repo)
-        except Exception as e:
-            logger.error(f"Error downloading repository: {e}")
-            run_command(f"rm -fr {repo}")
-            failed.append(repo)
-            continue
         logger.info(f"Processing repository: {repo}")
-        logger.info(f"Attempting to run CMake: {repo}")
-        comp_path = generate_compile_commands(repo_path)
-        if not comp_path:
+        with stages.configure, Config.METRICS.stage(repo, 'configure') as metrics, Config.LIMITS.stage('configure'):
+            try:
+                configured = configure_repository(repo, repo_path, checkout)
+            except CommandTimeout as e:
+                metrics['outcome'] = 'timed_out'
+                logger.error(f"Configure timed out: {repo}: {e}")
+                return "timed_out"
+            metrics['outcome'] = configured
+        if configured == "non_cmake":
             logger.error(f"Unable to locate CMakeLists.txt: {repo}")
-            run_command(f"rm -fr {repo}")
-            non_cmake.append(repo)
-            continue
-        try:
-            success, cmake_failed, ran_on_tool = run_clang_tool(repo_path, cmake_failed, ran_on_tool)
-            if not success:
-                logger.error(f"Failed to run Clang tool on repository: {repo}")
-            else:
+            return "non_cmake"
+        elif configured == "cmake_failed":
+            logger.error(f"Failed to locate compile_commands.json: {repo}")
+            return "cmake_failed"
+
+        with stages.tool, Config.METRICS.stage(repo, 'tool') as metrics, Config.LIMITS.stage('tool'):
+            try:
+                ran = run_clang_tool(repo_path, libraries)
+                if ran == "cmake_failed":
+                    metrics['outcome'] = 'failed'
+                    logger.error(f"Failed to run Clang tool on repository: {repo}")
+                    return "cmake_failed"
+                metrics['calls'] = {library: count_calls(result_path(repo, library))
+                                    for library in libraries if result_path(repo, library) is not None}
+                if ran == "tool_failed":
+                    metrics['outcome'] = 'tool_failed'
+                    logger.error(f"Clang tool failed on repository: {repo}")
+                    return "tool_failed"
                 logger.info(f"Ran Clang tool on repository: {repo}")
-        except Exception as e:
-            logger.error(f"Failed to generate compile commands for repository: {repo}")
-            logger.error(f"Error: {e}")
-        if not run_command(f"rm -fr {repo}"):
-            logger.error(f"failed to remove repo:{repo}")
-    return failed, non_cmake, cmake_failed, ran_on_tool
+            except CommandTimeout as e:
+                metrics['outcome'] = 'timed_out'
+                logger.error(f"Clang tool timed out: {repo}: {e}")
+                return "timed_out"
+            except Exception as e:
+                metrics['outcome'] = 'tool_failed'
+                logger.error(f"Failed to run Clang tool on repository: {repo}")
+                logger.error(f"Error: {e}")
+                return "tool_failed"
+        return "ran_on_tool"
+    finally:
+        cleanup_repo(repo, stages)
+        stages.end_checkout()
+
+
+def order_by_cost(repos):
+    """Most expensive repositories first, so the longest jobs don't start last and stretch the end of the run.
+
+    The cost is the time a repository took in earlier runs, else its translation units in the build cache times the
+    usual find-call time per unit. Repositories without either are placed at the median cost.
+    """
+    known, seconds_per_tu = previous_costs(Config.METRICS.path) if Config.METRICS.path else ({}, None)
+    costs = {}
+    for repo in repos:
+        if repo in known:
+            costs[repo] = known[repo]
+        elif Config.BUILD_CACHE is not None:
+            tus = Config.BUILD_CACHE.translation_units(repo)
+            if tus is not None:
+                costs[repo] = tus * (seconds_per_tu or 1.0)
+    default = statistics.median(costs.values()) if costs else 0.0
+    logger.info(f"Estimated the cost of {len(costs)} of {len(repos)} repositories from earlier runs")
+    return sorted(repos, key=lambda repo: -costs.get(repo, default))
+
+
+def process_repositories(clients, journal):
+    """Scan each client repository once for all of the libraries it depends on.
+
+    clients maps repository name -> library names.
+    """
+    dir_path = Config.WORKING_DIR
+    # Skip libraries a previous run completed for a repository, only failures are retried
+    completed = {library: journal.completed(library) for library in Config.LIBRARIES}
+    pending = {}
+    for repo, libraries in clients.items():
+        remaining = [library for library in libraries if repo not in completed[library]]
+        if repo not in Config.IGNORE_LIST and remaining:
+            pending[repo] = remaining
+    logger.info(f"Skipping {len(clients) - len(pending)} repositories already completed or ignored")
 
+    logger.info(f"Scanning Repositories in: {dir_path}")
+    pending = {repo: pending[repo] for repo in order_by_cost(list(pending))}
+    stages = PipelineStages()
+    # Each worker carries one checkout through every stage, the stage semaphores bound the work per stage
+    with ThreadPoolExecutor(max_workers=Config.MAX_CHECKOUTS) as executor:
+        list(executor.map(lambda item: process_repository(item[0], item[1], stages, journal), pending.items()))
 
-def download_repo(repo):
-    owner, name = repo.split("@@")
-    r_url = f"https://github.com/{owner}/{name}.git"
-    logger.info(f"Cloning {repo} from {r_url}")
-    return Repo.clone_from(r_url, repo,
-                                multi_options=["--recurse-submodules", "-j6", " --depth 1", "--shallow-submodules"])
+    return {library: (journal.repos(library, "failed"), journal.repos(library, "non_cmake"),
+                      journal.repos(library, "cmake_failed"), journal.repos(library, "ran_on_tool"),
+                      journal.repos(library, "timed_out"), journal.repos(library, "tool_failed"))
+            for library in Config.LIBRARIES}
 
 
-def find_client_repos(json_obj):
-    result = []
-    for key, value in json_obj.items():
-        if isinstance(value, dict) and value:
-            if Config.LIBRARY_NAME in value:
-                result.append(key)
-    return result
+def download_repo(repo, libraries=()):
+    """Check out repo into the working directory.
 
-# Find potential client repos that use cmake or submodule to manage dependency
-def find_client_repos_opt(json_obj):
-    result = []
-    for key, value in json_obj.items():
-        if isinstance(value, dict) and value:
-            if Config.LIBRARY_NAME in value:
-                for evi in value[Config.LIBRARY_NAME]:
-                    if evi["extractor_type"] == "cmake" or evi["extractor_type"] == "submod":
-                        result.append(key)
-                        break
-    return result
-
-
-def find_all_libs(json_obj):
-    result = set()
-    for key, value in json_obj.items():
-        if isinstance(value, dict):
-            result.update(value.keys())
-    return result
-
-
-def find_popular_libs(json_obj):
-    result = {}
-    for key, value in json_obj.items():
-        if value and isinstance(value, dict):
-            for lib in value.keys():
-                if lib not in result:
-                    result[lib] = 1
-                else:
-                    result[lib] = result[lib] + 1
-    result = dict(sorted(result.items(), key=lambda item: item[1]))
-    return result
+    Returns None for a full checkout with every submodule, else a description of the sparse checkout and the
+    submodules it includes, which the build cache keeps configure results apart by. Raises CommandTimeout once the
+    download stage runs out of time.
+    """
+    owner, name = repo.split("@@")
+    r_url = f"{Config.GIT_BASE_URL}/{owner}/{name}.git"
+    try:
+        if Config.CLONE_CACHE is not None:
+            logger.info(f"Checking out {repo} from clone cache of {r_url}")
+            Config.CLONE_CACHE.checkout(r_url, repo, Config.WORKING_DIR / repo, submodules=True,
+                                        timeout=Config.LIMITS.remaining)
+            return None
+        if Config.SPARSE_CLONE:
+            logger.info(f"Sparse cloning {repo} from {r_url}")
+            client = sparse_clone(r_url, Config.WORKING_DIR / repo, timeout=Config.LIMITS.remaining)
+            submodules = checkout_submodules(client, libraries, timeout=Config.LIMITS.remaining)
+            return "sparse:" + ",".join(sorted(submodules))
+    except GitCommandError:
+        # A git command killed for running out of time raises a plain command error
+        Config.LIMITS.remaining()
+        raise
+    logger.info(f"Cloning {repo} from {r_url}")
+    # A clone through run_command is killed with its process group once the stage runs out of time
+    if not run_command(f"git clone --recurse-submodules -j6 --depth 1 --shallow-submodules {r_url} {repo}",
+                       Config.WORKING_DIR):
+        raise RuntimeError(f"git clone of {r_url} failed")
+    return None
 
 
-def find_popular_libs_cmake_submod(data):
-    library_counts = {}
-    for project, dependencies in data.items():
-        for dependency, occurrences in dependencies.items():
-            for occurrence in occurrences:
-                if occurrence['extractor_type'] in ['cmake', 'submod']:
-                    library_counts[dependency] = library_counts.get(dependency, 0) + 1
-                    break
+def find_client_repos(index, library_name):
+    return index.clients(library_name)
 
-    library_counts = dict(sorted(library_counts.items(), key=lambda item: item[1]))
-    return library_counts
+# Find potential client repos that use cmake or submodule to manage dependency
+def find_client_repos_opt(index, library_name):
+    return index.clients(library_name, CLIENT_EXTRACTORS)
+
+
+# Union of the potential clients of several libraries, mapping each client to the libraries it uses
+def find_client_repos_multi(index, library_names):
+    return index.clients_multi(library_names, CLIENT_EXTRACTORS)
+
+
+def find_all_libs(index):
+    return index.libraries()
+
+
+def find_popular_libs(index):
+    return index.popularity()
+
+
+def find_popular_libs_cmake_submod(index):
+    return index.popularity(CLIENT_EXTRACTORS)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Collect client usage data of one or more libraries')
+    parser.add_argument('tool_path', type=str, help='Directory containing bin/find-call')
+    parser.add_argument('library_name', type=str, nargs='?', help='Library name as used in the dependency dataset')
+    parser.add_argument('header_regex', type=str, nargs='?', help="Library header files/paths - 'json/json.h|etc'")
+    parser.add_argument('exclude_paths', type=str, nargs='*', help='Additional source paths to exclude')
+    parser.add_argument('--library', type=str, action='append', default=[], metavar='NAME=REGEX',
+                        help='Additional library and header regex to scan for in the same pass, may be repeated')
+    parser.add_argument('--download-workers', type=int, default=Config.DOWNLOAD_WORKERS)
+    parser.add_argument('--configure-workers', type=int, default=Config.CONFIGURE_WORKERS)
+    parser.add_argument('--tool-workers', type=int, default=Config.TOOL_WORKERS)
+    parser.add_argument('--tool-jobs', type=int, default=None,
+                        help='Translation units each find-call run parses in parallel, default CPUs / tool workers')
+    parser.add_argument('--ndjson', action='store_true',
+                        help='Write results as NDJSON, one compact record per line, instead of indented json')
+    parser.add_argument('--layout', type=str, default=Config.LAYOUT, choices=['calls', 'declarations', 'collapsed'],
+                        help='Result layout, declarations and collapsed write each callee declaration once')
+    parser.add_argument('--no-prefilter', action='store_true',
+                        help='Run find-call on every file instead of only those whose includes reach the library')
+    parser.add_argument('--pch', action='store_true',
+                        help='Parse files with a precompiled header of the includes shared by each compile flag group')
+    parser.add_argument('--cleanup-workers', type=int, default=Config.CLEANUP_WORKERS)
+    parser.add_argument('--max-checkouts', type=int, default=Config.MAX_CHECKOUTS,
+                        help='Maximum number of client repositories on disk at once')
+    parser.add_argument('--min-free-disk', type=float, default=Config.MIN_FREE_DISK / 1024 ** 3,
+                        help='Pause downloads while free disk space (GB) is below this')
+    parser.add_argument('--journal', type=str, default=str(Config.JOURNAL_PATH),
+                        help='SQLite journal of repository outcomes, completed repositories are skipped on rerun')
+    parser.add_argument('--git-base-url', type=str, default=Config.GIT_BASE_URL,
+                        help='Base URL (or local directory) client repositories are cloned from')
+    parser.add_argument('--clone-cache', type=str, default=None,
+                        help='Directory of bare mirrors shared between runs, clients are checked out from it')
+    parser.add_argument('--clone-cache-max-gb', type=float, default=None,
+                        help='Evict least recently used mirrors once the clone cache exceeds this size')
+    parser.add_argument('--sparse-clone', action='store_true',
+                        help='Blobless clones of only build files and sources, skipping submodules the build does not '
+                             'reference unless they are a scanned library')
+    parser.add_argument('--build-cache', type=str, default=str(Config.WORKING_DIR / 'build_cache'),
+                        help='Directory caching compile_commands.json and configure outcomes per repository commit')
+    parser.add_argument('--no-build-cache', action='store_true', help='Always run CMake configure')
+    parser.add_argument('--cmake-failure-ttl', type=float, default=Config.CMAKE_FAILURE_TTL / 3600,
+                        help='Hours a cached CMake failure is reused before configure is retried, 0 to always retry')
+    parser.add_argument('--download-timeout', type=float, default=Config.DOWNLOAD_TIMEOUT,
+                        help='Seconds cloning may take per repository, 0 for no limit')
+    parser.add_argument('--configure-timeout', type=float, default=Config.CONFIGURE_TIMEOUT,
+                        help='Seconds CMake configure may take per repository, 0 for no limit')
+    parser.add_argument('--tool-timeout', type=float, default=Config.TOOL_TIMEOUT,
+                        help='Seconds find-call may take per repository, 0 for no limit')
+    parser.add_argument('--memory-limit-gb', type=float, default=None,
+                        help='Virtual memory limit of each configure, find-call and full clone command')
+    parser.add_argument('--cpu-limit', type=float, default=None,
+                        help='CPU seconds limit of each configure, find-call and full clone command')
+    parser.add_argument('--metrics', type=str, default=str(Config.WORKING_DIR / 'find_usage_metrics.jsonl'),
+                        help='JSONL of per repository, per stage wall time, CPU time and peak RSS')
+    parser.add_argument('--dependencies', type=str, default=str(Config.WORKING_DIR / 'repo2dep.json'),
+                        help='Dependency dataset, repo2dep.json or a directory of dependency_discovery results')
+    parser.add_argument('--index', type=str, default=None,
+                        help='SQLite index of the dependency dataset, default <dependencies>.index.sqlite')
+    args = parser.parse_args()
+    if not args.library_name and not args.library:
+        parser.error('a library_name and header_regex or at least one --library is required')
+    if not os.path.exists(args.dependencies):
+        parser.error(f"--dependencies '{args.dependencies}' does not exist")
+    if args.library_name and not args.header_regex:
+        parser.error('header_regex is required with library_name')
+    for library in args.library:
+        if '=' not in library:
+            parser.error(f"--library expects NAME=REGEX, got '{library}'")
+    return args
 
 
 def main():
-    # Check if file path was passed as command-line argument
-    if len(sys.argv) < 3:
-        print("Usage: python script.py <file_path> <library_name> <header_regex> <exclude_path>")
-        return
+    args = parse_args()
 
     # Setup
     Config.EXCLUDE_PATHS = ["/libs/", "/common/", "/third-party/", "/thirdparty/", "/third_party/", "/external/"]
-    Config.EXCLUDE_PATHS.extend(sys.argv[3:])
-    Config.LIBRARY_NAME = sys.argv[2]
-    Config.TOOL_PATH = sys.argv[1]
-    Config.HEADER_PATTERN = sys.argv[3]
-
-    working_path = Config.WORKING_DIR / "repo2dep.json"
-
-    # Try to open the dependencies file
+    Config.EXCLUDE_PATHS.extend(args.exclude_paths)
+    Config.LIBRARIES = {}
+    if args.library_name:
+        Config.LIBRARIES[args.library_name] = args.header_regex
+    for library in args.library:
+        name, header_regex = library.split('=', 1)
+        Config.LIBRARIES[name] = header_regex
+    Config.TOOL_PATH = args.tool_path
+    Config.DOWNLOAD_WORKERS = args.download_workers
+    Config.CONFIGURE_WORKERS = args.configure_workers
+    Config.TOOL_WORKERS = args.tool_workers
+    Config.TOOL_JOBS = args.tool_jobs or max(1, (os.cpu_count() or 1) // Config.TOOL_WORKERS)
+    Config.CLEANUP_WORKERS = args.cleanup_workers
+    Config.NDJSON = args.ndjson
+    Config.LAYOUT = args.layout
+    Config.PREFILTER = not args.no_prefilter
+    Config.PCH = args.pch
+    Config.MAX_CHECKOUTS = args.max_checkouts
+    Config.MIN_FREE_DISK = int(args.min_free_disk * 1024 ** 3)
+    Config.JOURNAL_PATH = Path(args.journal)
+    Config.GIT_BASE_URL = args.git_base_url.rstrip('/')
+    if args.clone_cache:
+        max_bytes = int(args.clone_cache_max_gb * 1024 ** 3) if args.clone_cache_max_gb else None
+        Config.CLONE_CACHE = CloneCache(args.clone_cache, max_bytes)
+    Config.SPARSE_CLONE = args.sparse_clone
+    Config.METRICS = StageMetrics(args.metrics)
+    Config.DOWNLOAD_TIMEOUT = args.download_timeout or None
+    Config.CONFIGURE_TIMEOUT = args.configure_timeout or None
+    Config.TOOL_TIMEOUT = args.tool_timeout or None
+    Config.LIMITS = StageLimits({'download': Config.DOWNLOAD_TIMEOUT, 'configure': Config.CONFIGURE_TIMEOUT,
+                                 'tool': Config.TOOL_TIMEOUT},
+                                args.memory_limit_gb * 1024 if args.memory_limit_gb else None, args.cpu_limit)
+    if not args.no_build_cache:
+        Config.BUILD_CACHE = BuildCache(args.build_cache, args.cmake_failure_ttl * 3600)
+
+    working_path = Path(args.dependencies)
+
+    # Open the dependency index, built from the dependencies file on first use
     try:
-        with open(working_path, 'r') as file:
-            # Find potential client repositories
-            json_str = file.read()
-            json_obj = json.loads(json_str)
-            repos = find_client_repos_opt(json_obj)
-
-            # Process client repositories for dependencies
-            download_failed, non_cmake, cmake_failed, ran_on_tool = process_repositories(repos)
-
-            # Log run summary
-            logger.info(f"all repos ({len(repos)}): {repos}")
-            logger.info(f"failed to download ({len(download_failed)}): {download_failed}")
-            logger.info(f"non cmake repos ({len(non_cmake)}): {non_cmake}")
-            logger.info(f"cmake failed repos ({len(cmake_failed)}): {cmake_failed}")
-            logger.info(f"ran on tool repos ({len(ran_on_tool)}):{ran_on_tool}")
+        index = open_index(working_path, args.index)
     except FileNotFoundError:
         logger.error(f"No such file or directory: '{working_path}'")
-    except IOError as e:
+        return
+    except (IOError, ValueError) as e:
         logger.error(f"Error occurred while trying to read file: '{working_path}: {e}'")
+        return
 
+    # Find potential client repositories
+    clients = find_client_repos_multi(index, Config.LIBRARIES)
+    index.close()
+
+    # Process client repositories for dependencies
+    journal = RunJournal(Config.JOURNAL_PATH)
+    summaries = process_repositories(clients, journal)
+    journal.close()
+
+    # Log run summary
+    logger.info(f"all repos ({len(clients)}): {list(clients)}")
+    for library, (download_failed, non_cmake, cmake_failed, ran_on_tool, timed_out, tool_failed) in summaries.items():
+        logger.info(f"[{library}] failed to download ({len(download_failed)}): {download_failed}")
+        logger.info(f"[{library}] non cmake repos ({len(non_cmake)}): {non_cmake}")
+        logger.info(f"[{library}] cmake failed repos ({len(cmake_failed)}): {cmake_failed}")
+        logger.info(f"[{library}] ran on tool repos ({len(ran_on_tool)}):{ran_on_tool}")
+        logger.info(f"[{library}] timed out repos ({len(timed_out)}): {timed_out}")
+        logger.info(f"[{library}] tool failed repos ({len(tool_failed)}): {tool_failed}")
 
 if __name__ == "__main__":
     main()
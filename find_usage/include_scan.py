@@ -0,0 +1,114 @@
+import os
+import re
+import shlex
+
+INCLUDE_DIRECTIVE = re.compile(r'^\s*#\s*(?:include|import|include_next)\s*([<"])([^>"]+)[>"]', re.MULTILINE)
+# Includes through a macro, e.g. #include FT_FREETYPE_H, can't be resolved without preprocessing
+MACRO_INCLUDE = re.compile(r'^\s*#\s*(?:include_next|include|import)\b\s*[A-Za-z_]', re.MULTILINE)
+SEARCH_FLAGS = ('-I', '-isystem', '-iquote', '-idirafter')
+DEFAULT_SYSTEM_DIRS = ('/usr/local/include', '/usr/include')
+
+
+def command_arguments(entry):
+    if 'arguments' in entry:
+        return entry['arguments']
+    return shlex.split(entry['command'])
+
+
+def search_paths(entry):
+    """Quote and angle include directories plus forced includes (-include) of a compile_commands.json entry."""
+    directory = entry.get('directory', '')
+    args = command_arguments(entry)
+    quote_dirs, angle_dirs, forced = [], [], []
+    i = 0
+    while i < len(args):
+        arg = args[i]
+        # -include takes a separate argument, also keeps -include-pch from matching
+        flag = '-include' if arg == '-include' else next((flag for flag in SEARCH_FLAGS if arg.startswith(flag)), None)
+        if flag is not None:
+            value = arg[len(flag):]
+            if not value and i + 1 < len(args):
+                i += 1
+                value = args[i]
+            path = os.path.normpath(os.path.join(directory, value))
+            if flag == '-include':
+                forced.append(path)
+            elif flag == '-iquote':
+                quote_dirs.append(path)
+            else:
+                angle_dirs.append(path)
+        i += 1
+    return quote_dirs, angle_dirs + list(DEFAULT_SYSTEM_DIRS), forced
+
+
+class IncludeScanner:
+    """Decides from include directives alone whether a translation unit can reach a library header.
+
+    Conditional compilation is ignored, so the answer over-approximates what the preprocessor would include:
+    a TU is only skipped when none of the headers it could include match the header regex.
+    """
+
+    def __init__(self, header_regex):
+        self.header_regex = re.compile(header_regex)
+        # Include directives of each file read so far and resolved includes, shared by every TU of the repository
+        self.directives = {}
+        self.resolved = {}
+
+    def read_directives(self, path):
+        directives = self.directives.get(path)
+        if directives is None:
+            try:
+                with open(path, 'r', errors='replace') as f:
+                    text = f.read()
+            except OSError:
+                text = ''
+            directives = (INCLUDE_DIRECTIVE.findall(text), MACRO_INCLUDE.search(text) is not None)
+            self.directives[path] = directives
+        return directives
+
+    def resolve(self, includer, delimiter, name, quote_dirs, angle_dirs):
+        dirs = tuple(angle_dirs)
+        if delimiter == '"':
+            dirs = (os.path.dirname(includer),) + tuple(quote_dirs) + dirs
+        key = (dirs, name)
+        if key not in self.resolved:
+            self.resolved[key] = next((os.path.normpath(os.path.join(directory, name)) for directory in dirs
+                                       if os.path.isfile(os.path.join(directory, name))), None)
+        return self.resolved[key]
+
+    def matches(self, path):
+        return self.header_regex.search(path) is not None
+
+    def reaches_library(self, entry):
+        directory = entry.get('directory', '')
+        source = os.path.normpath(os.path.join(directory, entry['file']))
+        quote_dirs, angle_dirs, forced = search_paths(entry)
+
+        pending = [source] + forced
+        visited = set()
+        while pending:
+            path = pending.pop()
+            if path in visited:
+                continue
+            visited.add(path)
+            if path != source and self.matches(path):
+                return True
+
+            includes, has_macro_include = self.read_directives(path)
+            if has_macro_include:
+                # Can't tell what a macro include expands to, keep the TU
+                return True
+            for delimiter, name in includes:
+                # The spelled name is enough when the library is not installed where this scan can see it
+                if self.matches(name):
+                    return True
+                resolved = self.resolve(path, delimiter, name, quote_dirs, angle_dirs)
+                if resolved is not None and resolved not in visited:
+                    pending.append(resolved)
+        return False
+
+
+def filter_entries(entries, header_patterns):
+    """Keep the compile_commands.json entries whose TU can include a header matching any of header_patterns."""
+    scanner = IncludeScanner('|'.join(f'(?:{pattern})' for pattern in header_patterns))
+    return [entry for entry in entries if scanner.reaches_library(entry)]
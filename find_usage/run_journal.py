@@ -0,0 +1,81 @@
+import sys
+import time
+import sqlite3
+import threading
+
+# Outcomes that are final, repositories with any other outcome are retried on the next run
+COMPLETED = ('non_cmake', 'ran_on_tool')
+OUTCOMES = ('downloaded', 'failed', 'non_cmake', 'cmake_failed', 'ran_on_tool', 'timed_out', 'tool_failed')
+
+
+class RunJournal:
+    """Persistent record of the outcome of every client repository processed by find_usage."""
+
+    def __init__(self, path):
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(str(path), check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS runs (
+                library TEXT NOT NULL,
+                repo TEXT NOT NULL,
+                outcome TEXT NOT NULL,
+                result_path TEXT,
+                duration REAL,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (library, repo)
+            )""")
+
+    def record(self, library, repo, outcome, result_path=None, duration=None):
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO runs (library, repo, outcome, result_path, duration, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (library, repo, outcome, result_path, duration, time.time()))
+
+    def outcome(self, library, repo):
+        with self.lock:
+            row = self.conn.execute("SELECT outcome FROM runs WHERE library = ? AND repo = ?",
+                                    (library, repo)).fetchone()
+        return row[0] if row else None
+
+    def completed(self, library):
+        with self.lock:
+            rows = self.conn.execute(
+                f"SELECT repo FROM runs WHERE library = ? AND outcome IN ({','.join('?' * len(COMPLETED))})",
+                (library, *COMPLETED)).fetchall()
+        return {repo for repo, in rows}
+
+    def repos(self, library, outcome):
+        with self.lock:
+            rows = self.conn.execute("SELECT repo FROM runs WHERE library = ? AND outcome = ? ORDER BY repo",
+                                     (library, outcome)).fetchall()
+        return [repo for repo, in rows]
+
+    def summary(self, library=None):
+        query = "SELECT library, outcome, COUNT(*), SUM(duration) FROM runs"
+        params = ()
+        if library:
+            query += " WHERE library = ?"
+            params = (library,)
+        with self.lock:
+            return self.conn.execute(query + " GROUP BY library, outcome ORDER BY library, outcome",
+                                     params).fetchall()
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+def print_summary(path, library=None):
+    journal = RunJournal(path)
+    for library, outcome, count, duration in journal.summary(library):
+        print(f"{library}\t{outcome}\t{count}\t{duration or 0:.1f}s")
+    journal.close()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python run_journal.py <journal_path> [library_name]")
+    else:
+        print_summary(sys.argv[1], sys.argv[2] if len(sys.argv) > 2 else None)
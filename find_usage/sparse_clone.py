@@ -0,0 +1,112 @@
+import os
+import re
+import logging
+from pathlib import Path
+
+from git import GitCommandError, Repo
+
+from common.clone_cache import run_git, time_left
+
+logger = logging.getLogger(__name__)
+
+# Files CMake configure and find-call read, other blobs (assets, test data, binaries) are never fetched
+SPARSE_PATTERNS = ['/.gitmodules', 'CMakeLists.txt', '*.cmake', '*.in', '*.c', '*.cc', '*.cpp', '*.cxx', '*.c++',
+                   '*.h', '*.hh', '*.hpp', '*.hxx', '*.h++', '*.inc', '*.inl', '*.ipp', '*.tcc', '*.def']
+
+
+def fetch(repo, rev, depth, timeout=None):
+    try:
+        run_git('fetch', 'origin', rev, cwd=repo.working_dir, timeout=timeout, depth=depth, filter='blob:none')
+    except GitCommandError:
+        # Servers may refuse to serve a commit by SHA, fetch every branch instead
+        if rev == 'HEAD':
+            raise
+        logger.info(f"Fetching all branches of {repo.working_dir} to reach {rev}")
+        run_git('fetch', 'origin', cwd=repo.working_dir, timeout=timeout, filter='blob:none')
+
+
+def sparse_clone(url, dest, rev='HEAD', patterns=SPARSE_PATTERNS, depth=1, timeout=None):
+    """Blobless clone of url checking out only the files matching patterns at rev, the default branch by default.
+
+    Fetching with a blob filter makes origin a promisor remote, git fetches the blobs of the sparse checkout in one
+    batch on checkout. Local repositories need uploadpack.allowFilter=true to serve the filter over file://.
+    timeout is called before each command that talks to the remote for the seconds it may take, the command is
+    killed once they run out.
+    """
+    repo = Repo.init(dest)
+    repo.git.remote('add', 'origin', url)
+    repo.git.sparse_checkout('set', '--no-cone', *patterns)
+    fetch(repo, rev, depth, timeout)
+    # Checkout fetches the blobs of the sparse files from the promisor remote
+    run_git('checkout', 'FETCH_HEAD' if rev == 'HEAD' else rev, cwd=repo.working_dir, timeout=timeout)
+    return repo
+
+
+def cmake_files(root):
+    """(directory relative to root, contents) of the CMake files checked out under root."""
+    for directory, dirs, files in os.walk(root):
+        dirs[:] = [d for d in dirs if d != '.git']
+        for file in files:
+            if file == 'CMakeLists.txt' or file.endswith('.cmake'):
+                try:
+                    with open(os.path.join(directory, file), 'r', errors='replace') as f:
+                        yield os.path.relpath(directory, root), f.read()
+                except OSError:
+                    pass
+
+
+def mentions(text, path):
+    return re.search(r'(?<![\w.-])' + re.escape(path) + r'(?![\w.-])', text) is not None
+
+
+def is_build_input(path, cmake_texts):
+    # add_subdirectory(third_party/fmt) from the root, or add_subdirectory(fmt) from third_party/CMakeLists.txt
+    for directory, text in cmake_texts:
+        relative = os.path.normpath(os.path.relpath(path, directory))
+        if mentions(text, path) or (not relative.startswith('..') and mentions(text, relative)):
+            return True
+    return False
+
+
+def is_library(name, path, url, libraries):
+    candidates = [name, os.path.basename(path), os.path.basename(url.rstrip('/'))]
+    return any(library.lower() in candidate.lower() for library in libraries for candidate in candidates)
+
+
+def checkout_submodules(repo, libraries, patterns=SPARSE_PATTERNS, depth=1, timeout=None):
+    """Sparse clone the submodules that the CMake files reference or that are one of the libraries, recursively.
+
+    Returns the paths of the submodules checked out, relative to repo.
+    """
+    root = Path(repo.working_dir)
+    if not (root / '.gitmodules').exists():
+        return []
+    try:
+        paths = repo.git.config('-f', '.gitmodules', '--get-regexp', r'^submodule\..*\.path$').splitlines()
+    except GitCommandError:
+        return []
+
+    checked_out = []
+    cmake_texts = list(cmake_files(root))
+    for line in paths:
+        key, path = line.split(' ', 1)
+        name = key[len('submodule.'):-len('.path')]
+        url = repo.git.config('-f', '.gitmodules', '--get', f'submodule.{name}.url')
+        if not (is_build_input(path, cmake_texts) or is_library(name, path, url, libraries)):
+            logger.info(f"Skipping submodule {path} of {root.name}, not referenced by its CMake files")
+            continue
+        try:
+            # init resolves relative submodule URLs against origin
+            repo.git.submodule('init', '--', path)
+            url = repo.git.config('--get', f'submodule.{name}.url')
+            sha = repo.git.ls_tree('HEAD', path).split()[2]
+            sub_repo = sparse_clone(url, root / path, sha, patterns, depth, timeout)
+        except (GitCommandError, IndexError) as e:
+            logger.error(f"Failed to fetch submodule {path} of {root.name}: {e}")
+            # A fetch killed for running out of time ends the checkout rather than moving on to the next submodule
+            time_left(timeout)
+            continue
+        checked_out.append(path)
+        checked_out.extend(os.path.join(path, sub_path)
+                           for sub_path in checkout_submodules(sub_repo, libraries, patterns, depth, timeout))
+    return checked_out
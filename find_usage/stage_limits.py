@@ -0,0 +1,94 @@
+import os
+import time
+import signal
+import threading
+import contextlib
+
+# Exit status of a command killed for exceeding ulimit -t, as reported by its shell (128 + SIGXCPU) or when the
+# shell itself was the one killed
+CPU_LIMIT_EXIT = (128 + signal.SIGXCPU, -signal.SIGXCPU)
+
+
+class CommandTimeout(Exception):
+    """A command ran past the time its stage was given, or past the CPU time limit."""
+
+
+class StageLimits:
+    """Time budget per pipeline stage and resource limits of the commands run in it.
+
+    stage() gives the worker thread running it a deadline, every command run during the stage gets the time left.
+    Commands run in their own process group so a timeout kills cmake or find-call along with everything they
+    started. memory_mb and cpu_seconds are applied to each command with ulimit.
+    """
+
+    def __init__(self, timeouts=None, memory_mb=None, cpu_seconds=None, grace=5):
+        self.timeouts = timeouts or {}
+        self.memory_mb = memory_mb
+        self.cpu_seconds = cpu_seconds
+        self.grace = grace
+        self.local = threading.local()
+
+    @contextlib.contextmanager
+    def stage(self, stage):
+        timeout = self.timeouts.get(stage)
+        self.local.deadline = time.monotonic() + timeout if timeout else None
+        try:
+            yield
+        finally:
+            self.local.deadline = None
+
+    def remaining(self):
+        deadline = getattr(self.local, 'deadline', None)
+        if deadline is None:
+            return None
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise CommandTimeout("stage time budget exhausted")
+        return remaining
+
+    def wrap(self, command):
+        # ulimit in the same shell keeps the limits off this process, preexec_fn isn't safe with threads
+        limits = []
+        if self.memory_mb:
+            limits.append(f"ulimit -v {int(self.memory_mb * 1024)}")
+        if self.cpu_seconds:
+            # Soft limit only, the kernel then sends SIGXCPU rather than SIGKILL and the cause can be told apart
+            limits.append(f"ulimit -S -t {int(self.cpu_seconds)}")
+        if not limits:
+            return command
+        return "; ".join(limits) + "; " + command
+
+    def kill_group(self, process, done):
+        """SIGTERM the process group of a timed out command, SIGKILL it if still running after the grace period."""
+        for sig in (signal.SIGTERM, signal.SIGKILL):
+            try:
+                os.killpg(process.pid, sig)
+            except (ProcessLookupError, PermissionError):
+                return
+            if done.wait(self.grace):
+                # The shell exited, kill whatever it left behind in the group
+                with contextlib.suppress(ProcessLookupError, PermissionError):
+                    os.killpg(process.pid, signal.SIGKILL)
+                return
+
+    @contextlib.contextmanager
+    def watchdog(self, process, timeout):
+        """Kill the process group of process once timeout expires, yields an event set when it did."""
+        expired = threading.Event()
+        done = threading.Event()
+        if timeout is None:
+            yield expired
+            return
+
+        def expire():
+            if not done.wait(timeout):
+                expired.set()
+                self.kill_group(process, done)
+
+        thread = threading.Thread(target=expire, daemon=True)
+        thread.start()
+        try:
+            yield expired
+        finally:
+            done.set()
+            thread.join()
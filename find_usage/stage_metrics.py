@@ -0,0 +1,177 @@
+import os
+import sys
+import math
+import json
+import time
+import threading
+import contextlib
+
+STAGES = ('download', 'configure', 'tool', 'cleanup')
+
+
+def wait_with_rusage(process):
+    # wait4 reports the resources used by the child and every descendant it waited for, e.g. the compilers cmake runs
+    _, status, rusage = os.wait4(process.pid, 0)
+    process.returncode = os.waitstatus_to_exitcode(status)
+    return process.returncode, rusage
+
+
+def checkout_bytes(path):
+    """Bytes on disk of a checkout, in total and in its git directories (what was fetched)."""
+    total = git = 0
+    for root, dirs, files in os.walk(path):
+        in_git = '.git' in os.path.relpath(root, path).split(os.sep)
+        for f in files:
+            try:
+                size = os.lstat(os.path.join(root, f)).st_size
+            except OSError:
+                continue
+            total += size
+            if in_git:
+                git += size
+    return total, git
+
+
+def count_calls(file_path):
+    """Number of calls in a find-call result file, collapsed calls count every call site they stand for."""
+    calls = 0
+    with open(file_path, 'r') as f:
+        if file_path.endswith('.ndjson'):
+            for line in f:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                if 'call' in record:
+                    calls += record['call'].get('count', 1)
+                elif 'declaration' not in record:
+                    calls += 1
+        else:
+            data = json.load(f) or []
+            if isinstance(data, dict):
+                calls = sum(call.get('count', 1) for call in data.get('calls') or [])
+            else:
+                calls = len(data)
+    return calls
+
+
+class StageMetrics:
+    """Wall time, CPU time and peak RSS of every pipeline stage of every repository, appended to a JSONL file.
+
+    A stage is timed by the stage() context of the worker thread running it. Commands run during the stage add the
+    rusage of the child process, stages also record facts such as bytes cloned or translation units parsed.
+    Without a path nothing is written.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    @contextlib.contextmanager
+    def stage(self, repo, stage):
+        record = {'repo': repo, 'stage': stage, 'outcome': 'ok', 'wall': 0.0, 'cpu_user': 0.0, 'cpu_sys': 0.0,
+                  'max_rss_kb': 0, 'commands': 0}
+        self.local.record = record
+        start = time.perf_counter()
+        try:
+            yield record
+        except Exception:
+            record['outcome'] = 'error'
+            raise
+        finally:
+            record['wall'] = time.perf_counter() - start
+            self.local.record = None
+            self.write(record)
+
+    def current(self):
+        return getattr(self.local, 'record', None)
+
+    def add_rusage(self, rusage):
+        record = self.current()
+        if record is None:
+            return
+        record['cpu_user'] += rusage.ru_utime
+        record['cpu_sys'] += rusage.ru_stime
+        # ru_maxrss is in kilobytes on Linux, the peak of the largest process rather than a sum. It includes the
+        # forked interpreter before exec, so it never reads below this process's own RSS at the time
+        record['max_rss_kb'] = max(record['max_rss_kb'], rusage.ru_maxrss)
+        record['commands'] += 1
+
+    def annotate(self, **values):
+        record = self.current()
+        if record is not None:
+            record.update(values)
+
+    def write(self, record):
+        if self.path is None:
+            return
+        record['finished_at'] = time.time()
+        line = json.dumps(record)
+        with self.lock:
+            with open(self.path, 'a') as f:
+                f.write(line + '\n')
+
+
+def previous_costs(path):
+    """Seconds each repository took in earlier runs and the median find-call seconds per translation unit.
+
+    A repository's cost is the sum over stages of its latest record, so reruns replace rather than add up.
+    """
+    latest = {}
+    per_tu = []
+    try:
+        records = load_records(path)
+    except (OSError, ValueError):
+        return {}, None
+    for record in records:
+        latest[(record['repo'], record['stage'])] = record['wall']
+        if record['stage'] == 'tool' and record.get('tus'):
+            per_tu.append(record['wall'] / record['tus'])
+    costs = {}
+    for (repo, _), wall in latest.items():
+        costs[repo] = costs.get(repo, 0.0) + wall
+    return costs, percentile(sorted(per_tu), 50) if per_tu else None
+
+
+def percentile(values, q):
+    # Nearest rank on sorted values
+    return values[max(0, math.ceil(q / 100 * len(values)) - 1)]
+
+
+def load_records(path):
+    records = []
+    with open(path, 'r') as f:
+        for line in f:
+            if line.strip():
+                records.append(json.loads(line))
+    return records
+
+
+def print_summary(path, top=5):
+    records = load_records(path)
+    stages = [stage for stage in STAGES if any(record['stage'] == stage for record in records)]
+    stages += sorted({record['stage'] for record in records} - set(stages))
+    print("stage\trepos\twall p50/p90/p99/max (s)\ttotal wall\tcpu\tpeak rss")
+    for stage in stages:
+        stage_records = [record for record in records if record['stage'] == stage]
+        walls = sorted(record['wall'] for record in stage_records)
+        cpu = sum(record['cpu_user'] + record['cpu_sys'] for record in stage_records)
+        rss = max(record['max_rss_kb'] for record in stage_records) / 1024
+        print(f"{stage}\t{len(walls)}\t{percentile(walls, 50):.1f}/{percentile(walls, 90):.1f}/"
+              f"{percentile(walls, 99):.1f}/{walls[-1]:.1f}\t{sum(walls):.0f}s\t{cpu:.0f}s\t{rss:.0f}MB")
+
+    for stage in stages:
+        print(f"\nslowest {stage}:")
+        slowest = sorted((record for record in records if record['stage'] == stage), key=lambda record: -record['wall'])
+        for record in slowest[:top]:
+            extra = {key: value for key, value in record.items()
+                     if key not in ('repo', 'stage', 'wall', 'cpu_user', 'cpu_sys', 'max_rss_kb', 'finished_at')}
+            print(f"  {record['repo']}\t{record['wall']:.1f}s\tcpu {record['cpu_user'] + record['cpu_sys']:.1f}s\t"
+                  f"rss {record['max_rss_kb'] / 1024:.0f}MB\t{extra}")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python stage_metrics.py <metrics_path> [slowest_count]")
+    else:
+        print_summary(sys.argv[1], int(sys.argv[2]) if len(sys.argv) > 2 else 5)